@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
 from utils.analyser_utils import measure
+from utils.storage import openStorage, exportParquet
+from utils.trace import readTrace, summariseTrace, tracePath
 from utils.literals import (
     MEASURE_HEADERS,
+    MEASURE_OPTION_DEFAULTS,
     DEFAULT_IPERF_ADDRESS,
     DEFAULT_IPERF_PORT,
     DEFAULT_TARGET,
 )
-import argparse, csv, time, os, sys
+import argparse, time, sys
 
 
 def parseArgs():
@@ -16,7 +19,83 @@ def parseArgs():
     p.add_argument("--target", default=DEFAULT_TARGET)
     p.add_argument("--iperf_addr", default=DEFAULT_IPERF_ADDRESS)
     p.add_argument("--iperf_port", default=DEFAULT_IPERF_PORT)
-    p.add_argument("--out", default="survey.csv")
+    p.add_argument(
+        "--ping_interval",
+        type=float,
+        default=MEASURE_OPTION_DEFAULTS["ping_interval"],
+        help="seconds between ICMP probes",
+    )
+    p.add_argument(
+        "--concurrent_ping",
+        action="store_true",
+        help="run the ping stage alongside the ntp, nmcli and arp-scan stages",
+    )
+    p.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="stop each iperf3 direction once the throughput mean has converged",
+    )
+    p.add_argument(
+        "--min_duration",
+        type=float,
+        default=MEASURE_OPTION_DEFAULTS["min_duration"],
+        help="shortest adaptive iperf3 run in seconds",
+    )
+    p.add_argument(
+        "--max_duration",
+        type=int,
+        default=MEASURE_OPTION_DEFAULTS["max_duration"],
+        help="iperf3 run length in seconds (upper bound in adaptive mode)",
+    )
+    p.add_argument(
+        "--confidence",
+        type=float,
+        default=MEASURE_OPTION_DEFAULTS["confidence"],
+        help="confidence level of the throughput bound",
+    )
+    p.add_argument(
+        "--precision_pct",
+        type=float,
+        default=MEASURE_OPTION_DEFAULTS["precision_pct"],
+        help="adaptive runs stop once the bound is within this percent of the mean",
+    )
+    p.add_argument(
+        "--bidir",
+        action="store_true",
+        help="measure download and upload in one iperf3 --bidir session",
+    )
+    p.add_argument(
+        "--parallel",
+        type=int,
+        default=MEASURE_OPTION_DEFAULTS["parallel"],
+        help="number of parallel iperf3 streams",
+    )
+    p.add_argument(
+        "--ntp_ttl",
+        type=float,
+        default=MEASURE_OPTION_DEFAULTS["ntp_ttl"],
+        help="seconds a clock sync check stays valid",
+    )
+    p.add_argument(
+        "--out",
+        default="survey.csv",
+        help="measurement file, .db/.sqlite stores into SQLite instead of CSV",
+    )
+    p.add_argument(
+        "--export_parquet",
+        default=None,
+        help="write the contents of --out to this Parquet file and exit",
+    )
+    p.add_argument(
+        "--trace",
+        action="store_true",
+        help="time every stage and subprocess into a Chrome trace-event file next to --out",
+    )
+    p.add_argument(
+        "--trace_summary",
+        action="store_true",
+        help="print p50/p95 stage latencies from the trace file of --out and exit",
+    )
     p.add_argument(
         "--interval", type=float, default=1.0, help="seconds between samples"
     )
@@ -28,6 +107,42 @@ def parseArgs():
     return p.parse_args(sys.argv[1:])
 
 
+def printProgress(event):
+    if event["stage"] == "iperf3":
+        print(
+            f"  {event["direction"]} {event["start"]:5.1f}-{event["end"]:5.1f} s: {event["mbps"]} Mbit/s"
+        )
+    elif event["stage"] == "iperf3_summary":
+        for direction, result in event["results"].items():
+            streams = ", ".join(f"{s["mbps"]}" for s in result["streams"])
+            print(
+                f"  {direction}: {result["mbps"]} Mbit/s"
+                + (f" (streams: {streams})" if len(result["streams"]) > 1 else "")
+            )
+
+
+def printTraceSummary(path):
+    summary = summariseTrace(readTrace(path))
+    if not summary:
+        print(f"No spans in {path}")
+        return
+
+    def ms(value):
+        return "-" if value is None else f"{value:.1f}"
+
+    print(
+        f"{'span':<20} {'count':>6} {'p50 ms':>9} {'p95 ms':>9}"
+        f" {'spawn p50':>10} {'spawn p95':>10} {'bytes':>10}"
+    )
+    # Slowest first, that is where a slow point went.
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]["p50_ms"]):
+        print(
+            f"{name:<20} {stats['count']:>6} {ms(stats['p50_ms']):>9} {ms(stats['p95_ms']):>9}"
+            f" {ms(stats['spawn_p50_ms']):>10} {ms(stats['spawn_p95_ms']):>10}"
+            f" {'-' if stats['bytes'] is None else stats['bytes']:>10}"
+        )
+
+
 def repeating(args):
     print("Press Ctrl+C to stop")
     seq = 0
@@ -53,13 +168,13 @@ def repeating(args):
                 except Exception as e:
                     print(f"ERROR: {e}")
 
-            measure(args, row, writer, csvfile)
+            measure(args, row, storage, progress=printProgress)
 
             time.sleep(args.interval)
     except KeyboardInterrupt:
         print("\nStopping survey...")
     finally:
-        csvfile.close()
+        storage.close()
 
         print("Done.")
 
@@ -71,20 +186,27 @@ def single(args):
     row["position_y"] = args.y
     row["position_in_room"] = args.pir
 
-    measure(args, row, writer, csvfile)
+    measure(args, row, storage, progress=printProgress)
 
-    csvfile.close()
+    storage.close()
 
 
 if __name__ == "__main__":
     args = parseArgs()
 
-    first_write = not os.path.exists(args.out) or args.overwrite
-    csvfile = open(args.out, "w" if args.overwrite else "a", newline="")
-    writer = csv.DictWriter(csvfile, fieldnames=MEASURE_HEADERS)
-    if first_write:
-        writer.writeheader()
-        csvfile.flush()
+    if args.trace_summary:
+        printTraceSummary(tracePath(args.out))
+        sys.exit()
+
+    if args.export_parquet:
+        # Only reads --out, --overwrite must not truncate what is exported.
+        storage = openStorage(args.out, readonly=True)
+        exportParquet(storage, args.export_parquet)
+        storage.close()
+        print(f"Exported {args.out} to {args.export_parquet}")
+        sys.exit()
+
+    storage = openStorage(args.out, overwrite=args.overwrite)
 
     if not args.x or not args.y or not args.pir:
         repeating(args)
@@ -1,18 +1,109 @@
-from argparse import Namespace
+from argparse import ArgumentParser, Namespace
 from utils.analyser_utils import measure
-from utils.literals import SOCKET_PATH, MEASURE_HEADERS
-import csv, os, sys, socket, json, pwd
-
-CMD_START = "START_MEASUREMENT"
-CMD_CHANGE = "CHANGE"
-CMD_EXIT = "EXIT"
-
-RES_EMPTY_ARGS = b"EMPTY_ARGS"
-RES_MEASUREMENT_FINISHED = b"MEASUREMENT_FINISHED"
-RES_CHANGE_OK = b"CHANGE_OK"
-RES_ACK_EXIT = b"ACK_EXIT"
-RES_UNKNOWN_COMMAND = b"UNKNOWN_COMMAND"
-RES_COMMAND_ERROR_PREFIX = "COMMAND_ERROR "
+from utils.literals import (
+    SOCKET_PATH,
+    WORKER_IDLE_TIMEOUT,
+    WORKER_LOG_PATH,
+    MEASURE_HEADERS,
+    MEASURE_OPTION_DEFAULTS,
+    SAMPLER_DEFAULTS,
+)
+from utils.storage import openStorage, typedRow
+from utils.sampler import Sampler
+from utils.trace import tracePath
+from utils.protocol import (
+    CMD_START,
+    CMD_START_BATCH,
+    CMD_REORDER,
+    CMD_CHANGE,
+    CMD_STATUS,
+    CMD_CANCEL,
+    CMD_SAMPLER,
+    CMD_SAMPLES,
+    CMD_EXIT,
+    EVENT_PROGRESS,
+    EVENT_FINISHED,
+    EVENT_BATCH_FINISHED,
+    READY_LINE,
+    encodeFrame,
+    readFrame,
+    makeResponse,
+    makeError,
+    makeEvent,
+)
+import asyncio, itertools, os, sys, pwd, signal, stat, time
+
+
+class MeasurementCancelled(Exception):
+    pass
+
+
+class CommandError(Exception):
+    pass
+
+
+class Batch:
+    ids = itertools.count(1)
+
+    def __init__(self, total, writer, request_id):
+        self.id = next(Batch.ids)
+        self.total = total
+        self.writer = writer
+        self.request_id = request_id
+        self.outcomes = {"completed": [], "failed": [], "cancelled": []}
+
+    def remaining(self):
+        return self.total - sum(len(jobs) for jobs in self.outcomes.values())
+
+
+class Job:
+    ids = itertools.count(1)
+
+    def __init__(
+        self, position, args, storage, writer, request_id, batch=None, index=0
+    ):
+        self.id = next(Job.ids)
+        self.position = position
+        self.args = args
+        self.storage = storage
+        self.writer = writer
+        self.request_id = request_id
+        self.batch = batch
+        self.index = index
+        self.cancelled = False
+
+    def command(self):
+        return CMD_START if self.batch is None else CMD_START_BATCH
+
+    def info(self):
+        info = {"job": self.id, "position": list(self.position)}
+        if self.batch is not None:
+            info.update(
+                {"batch": self.batch.id, "index": self.index, "total": self.batch.total}
+            )
+        return info
+
+
+class WorkerState:
+    def __init__(self, uid, gid, persistent=False):
+        self.uid = uid
+        self.gid = gid
+        self.persistent = persistent
+        self.clients = 0
+        self.args = Namespace(
+            iperf_addr="",
+            iperf_port="",
+            target="",
+            out="",
+            iface="",
+            **MEASURE_OPTION_DEFAULTS,
+        )
+        self.storage = None
+        self.sampler: Sampler | None = None
+        self.queue: list[Job] = []
+        self.current: Job | None = None
+        self.jobs_available = asyncio.Event()
+        self.exit = asyncio.Event()
 
 
 # https://stackoverflow.com/questions/564695/is-there-a-way-to-change-effective-process-name-in-python
@@ -26,25 +117,25 @@ def setProcName(newname):
 
 
 def log(msg, file=sys.stdout):
-    print(f"[Worker]: {msg}", file=file)
+    print(f"[Worker]: {msg}", file=file, flush=True)
 
 
-def createCsvfile(args, original_uid, original_gid):
+def createStorage(args, original_uid, original_gid):
     first_write = not os.path.exists(args.out)
-    csvfile = open(args.out, "a", newline="")
-    writer = csv.DictWriter(csvfile, fieldnames=MEASURE_HEADERS)
-    if first_write:
-        os.chown(args.out, original_uid, original_gid)
-        writer.writeheader()
-        csvfile.flush()
+    storage = openStorage(args.out)
+
+    # SQLite keeps its WAL and shared-memory files next to the database, the
+    # GUI needs to be able to open them too to read while we are writing.
+    for path in storage.files():
+        if os.path.exists(path) and (first_write or path != args.out):
+            os.chown(path, original_uid, original_gid)
 
-    return (writer, csvfile)
+    return storage
 
 
-def createErrorResponse(command, error):
-    return (
-        RES_COMMAND_ERROR_PREFIX + json.dumps({"command": command, "error": str(error)})
-    ).encode()
+def sendFrame(writer, message):
+    if not writer.is_closing():
+        writer.write(encodeFrame(message))
 
 
 def getOriginalUserIDs():
@@ -61,139 +152,517 @@ def getOriginalUserIDs():
         sys.exit(1)
 
 
-def handleStart(command_args, args, writer, csvfile):
-    if not writer or not csvfile:
-        log("Measurements arguments not set before measurement start!")
-        return RES_EMPTY_ARGS
+def closeUnusedStorage(state, storage):
+    in_use = [job.storage for job in state.queue]
+    if state.current is not None:
+        in_use.append(state.current.storage)
 
-    try:
-        pos_x, pos_y, pos_room = command_args.split(",")
-    except ValueError as e:
-        log(f"Invalid position arguments: {command_args}")
-        return createErrorResponse(CMD_START, e)
+    if storage is not None and storage is not state.storage and storage not in in_use:
+        storage.close()
 
+
+def finishJob(job, outcome, error=None, row=None):
+    if outcome == "completed":
+        sendFrame(
+            job.writer,
+            makeEvent(job.request_id, EVENT_FINISHED, {**job.info(), "row": row}),
+        )
+    else:
+        sendFrame(
+            job.writer,
+            makeError(
+                job.request_id,
+                job.command(),
+                error,
+                {**job.info(), "outcome": outcome},
+            ),
+        )
+
+    batch = job.batch
+    if batch is None:
+        return
+
+    batch.outcomes[outcome].append(job.id)
+    if not batch.remaining():
+        log(f"Batch {batch.id} done")
+        sendFrame(
+            batch.writer,
+            makeEvent(
+                batch.request_id,
+                EVENT_BATCH_FINISHED,
+                {"batch": batch.id, **batch.outcomes},
+            ),
+        )
+
+
+def parsePosition(position):
+    # Whole numbers on the floor plan the GUI records: x 1..8 from the left,
+    # y 0 or 1 for the side of the corridor and the third of the room 1..3.
+    try:
+        if not isinstance(position, (list, tuple)) or any(
+            isinstance(part, (bool, float)) for part in position
+        ):
+            raise ValueError
+        pos_x, pos_y, pos_room = (int(part) for part in position)
+        if pos_x not in range(1, 9) or pos_y not in (0, 1) or pos_room not in (1, 2, 3):
+            raise ValueError
+        return (pos_x, pos_y, pos_room)
+    except (TypeError, ValueError):
+        log(f"Invalid position arguments: {position}")
+        raise CommandError(f"Invalid position: {position}")
+
+
+def parseOption(key, value, default):
+    # bool("false") is True, flags take a JSON bool or 1/0, true/false, yes/no.
+    try:
+        if isinstance(default, bool):
+            if isinstance(value, bool):
+                return value
+            if str(value).lower() in ("1", "true", "yes"):
+                return True
+            if str(value).lower() in ("0", "false", "no"):
+                return False
+            raise ValueError
+        if isinstance(value, bool):
+            raise ValueError
+        return type(default)(value)
+    except (TypeError, ValueError):
+        log(f"Invalid option {key}: {value!r}")
+        raise CommandError(f"Invalid value for {key}: {value!r}")
+
+
+def runJob(state, job, loop):
     row = {h: "" for h in MEASURE_HEADERS}
     row.update(
         {
-            "position_x": pos_x,
-            "position_y": pos_y,
-            "position_in_room": pos_room,
+            "position_x": job.position[0],
+            "position_y": job.position[1],
+            "position_in_room": job.position[2],
         }
     )
 
-    measure(args, row, writer, csvfile)
-    return RES_MEASUREMENT_FINISHED
+    # Progress is reported from the measurement thread, it is also the point
+    # where a cancelled job gets interrupted.
+    def progress(event):
+        if job.cancelled:
+            raise MeasurementCancelled(f"Job {job.id} cancelled")
+        loop.call_soon_threadsafe(
+            sendFrame,
+            job.writer,
+            makeEvent(job.request_id, EVENT_PROGRESS, {**event, **job.info()}),
+        )
+
+    trace = tracePath(job.args.out) if job.args.trace else None
+    new_trace = trace is not None and not os.path.exists(trace)
+
+    # The sampler would ping and read the link next to the exclusive stages.
+    sampler = state.sampler
+    if sampler is not None:
+        sampler.pause()
+    try:
+        measure(job.args, row, job.storage, progress=progress)
+    finally:
+        # A sampler started meanwhile was created paused too.
+        for running in {sampler, state.sampler} - {None}:
+            running.resume()
 
+    if new_trace and os.path.exists(trace):
+        os.chown(trace, state.uid, state.gid)
 
-def handleChange(command_args, args, uid, gid, csvfile):
-    options = json.loads(command_args)
+    return typedRow(row)
 
+
+async def runJobs(state):
+    loop = asyncio.get_running_loop()
+    while not state.exit.is_set():
+        await state.jobs_available.wait()
+        if not state.queue:
+            state.jobs_available.clear()
+            continue
+
+        job = state.current = state.queue.pop(0)
+        log(f"Running job {job.id} at {job.position}")
+        try:
+            row = await asyncio.to_thread(runJob, state, job, loop)
+            finishJob(job, "completed", row=row)
+        except MeasurementCancelled as e:
+            log(str(e))
+            finishJob(job, "cancelled", e)
+        except Exception as e:
+            log(f"Job {job.id} failed: {e}")
+            finishJob(job, "failed", e)
+        finally:
+            state.current = None
+            # Rows of a run of jobs are committed together, the file is
+            # complete for readers once the queue is empty.
+            if not state.queue:
+                job.storage.flush()
+            closeUnusedStorage(state, job.storage)
+
+
+def handleStart(command_args, state, writer, request_id):
+    if not state.storage:
+        log("Measurements arguments not set before measurement start!")
+        raise CommandError("Measurement arguments not set")
+
+    job = Job(
+        parsePosition(command_args.get("position")),
+        Namespace(**vars(state.args)),
+        state.storage,
+        writer,
+        request_id,
+    )
+    state.queue.append(job)
+    state.jobs_available.set()
+
+    return {"job": job.id}
+
+
+def handleStartBatch(command_args, state, writer, request_id):
+    if not state.storage:
+        log("Measurements arguments not set before measurement start!")
+        raise CommandError("Measurement arguments not set")
+
+    # Every position is checked before anything is queued, so a typo in a
+    # planned run does not leave half of it waiting in the queue.
+    positions = [parsePosition(p) for p in command_args.get("positions", [])]
+    if not positions:
+        raise CommandError("No positions given")
+
+    args = Namespace(**vars(state.args))
+    batch = Batch(len(positions), writer, request_id)
+    jobs = [
+        Job(position, args, state.storage, writer, request_id, batch, index)
+        for index, position in enumerate(positions)
+    ]
+    state.queue.extend(jobs)
+    state.jobs_available.set()
+
+    log(f"Queued batch {batch.id} with {len(jobs)} positions")
+    return {"batch": batch.id, "jobs": [job.id for job in jobs]}
+
+
+def handleReorder(command_args, state):
+    # The listed jobs move to the front of the queue in the given order, the
+    # rest keep their relative order behind them.
+    ids = command_args.get("jobs", [])
+    queued = {job.id: job for job in state.queue}
+    unknown = [job_id for job_id in ids if job_id not in queued]
+    if unknown:
+        raise CommandError(f"Jobs not queued: {unknown}")
+
+    front = [queued[job_id] for job_id in dict.fromkeys(ids)]
+    state.queue = front + [job for job in state.queue if job not in front]
+
+    return {"queued": [job.id for job in state.queue]}
+
+
+def handleChange(command_args, state):
+    options = command_args
+    # Checked before anything changes, a bad value leaves the old settings.
+    parsed = {
+        key: parseOption(key, options.get(key, default), default)
+        for key, default in MEASURE_OPTION_DEFAULTS.items()
+    }
+
+    args = state.args
     args.iperf_addr = options["iperf_addr"]
     args.iperf_port = options["iperf_port"]
     args.iface = options["iface"]
     args.target = options["target"]
+    for key, value in parsed.items():
+        setattr(args, key, value)
     args.out = os.path.join(options["pwd"], options["out"])
 
-    if csvfile:
-        csvfile.close()
+    if state.sampler is not None:
+        state.sampler.iface = args.iface
+        state.sampler.target = args.target
+
+    # Queued and running jobs keep the storage they were started with.
+    old_storage = state.storage
+    state.storage = createStorage(args, state.uid, state.gid)
+    closeUnusedStorage(state, old_storage)
+
+    return {}
+
+
+def handleStatus(state):
+    status = {
+        "running": None if state.current is None else state.current.id,
+        "position": None if state.current is None else state.current.position,
+        "batch": (
+            None
+            if state.current is None or state.current.batch is None
+            else state.current.batch.id
+        ),
+        "queued": [job.info() for job in state.queue],
+        "out": state.args.out,
+        "iface": state.args.iface,
+        "sampler": None if state.sampler is None else state.sampler.status(),
+        "persistent": state.persistent,
+        "clients": state.clients,
+    }
+    return status
+
+
+def handleCancel(command_args, state):
+    ids = set(command_args.get("jobs", []))
+    batches = set(command_args.get("batches", []))
+
+    def selected(job):
+        if not ids and not batches:
+            return True
+        return job.id in ids or (job.batch is not None and job.batch.id in batches)
+
+    cancelled = []
+    for job in list(state.queue):
+        if selected(job):
+            state.queue.remove(job)
+            cancelled.append(job.id)
+            closeUnusedStorage(state, job.storage)
+            finishJob(job, "cancelled", MeasurementCancelled(f"Job {job.id} cancelled"))
+
+    if state.current is not None and selected(state.current):
+        state.current.cancelled = True
+        cancelled.append(state.current.id)
+
+    return {"cancelled": cancelled}
+
+
+def handleSampler(command_args, state):
+    enabled = command_args.get("enabled", True)
+
+    if state.sampler is not None:
+        state.sampler.stop()
+        if not enabled:
+            log("Sampler stopped")
+            return state.sampler.status()
+
+    if enabled:
+        if not state.args.iface:
+            raise CommandError("Measurement arguments not set")
+
+        options = {
+            key: type(default)(command_args.get(key, default))
+            for key, default in SAMPLER_DEFAULTS.items()
+        }
+        if options["rate_hz"] <= 0 or options["capacity"] <= 0:
+            raise CommandError("rate_hz and capacity have to be positive")
 
-    writer, csvfile = createCsvfile(args, uid, gid)
-    return RES_CHANGE_OK, writer, csvfile
+        state.sampler = Sampler(state.args.iface, state.args.target, **options)
+        if state.current is not None:
+            state.sampler.pause()
+        state.sampler.start()
+        log(f"Sampler started at {options['rate_hz']} Hz")
 
+    return {"running": False} if state.sampler is None else state.sampler.status()
 
-def handleExit():
-    log("Shutting down...")
-    return RES_ACK_EXIT, True
 
+def handleSamples(command_args, state):
+    if state.sampler is None:
+        raise CommandError("Sampler is not running")
 
-def handleClient(conn, args, uid, gid, writer, csvfile):
-    last_command = ""
-    while True:
-        try:
-            data = conn.recv(1024)
-            if not data:
-                break
+    now = time.time()
+    since = command_args.get("since", now - float(command_args.get("window", 60)))
+    until = command_args.get("until")
 
-            request = data.decode("utf-8").strip()
-            log(f"Received '{request}'")
+    ring = state.sampler.ring
+    if command_args.get("aggregate", False):
+        return ring.aggregate(since, until)
+    return ring.window(since, until)
 
-            if not request:
-                continue
 
-            parts = request.split(" ", maxsplit=1)
-            command, command_args = parts[0], (parts[1] if len(parts) > 1 else "")
-            last_command = command
+def handleExit(state):
+    log("Shutting down...")
+    handleCancel({}, state)
+    if state.sampler is not None:
+        state.sampler.stop()
+    state.exit.set()
+    return {}
+
+
+async def handleClient(state, reader, writer):
+    state.clients += 1
+    log("Client connected.")
+    while not state.exit.is_set():
+        request_id, command = None, ""
+        try:
+            request = await readFrame(reader)
+            if request is None:
+                break
 
-            response = b""
-            should_exit = False
+            request_id = request.get("id")
+            command = request.get("command", "")
+            command_args = request.get("args", {})
+            log(f"Received {command} ({request_id})")
 
             if command == CMD_START:
-                response = handleStart(command_args, args, writer, csvfile)
+                data = handleStart(command_args, state, writer, request_id)
+            elif command == CMD_START_BATCH:
+                data = handleStartBatch(command_args, state, writer, request_id)
+            elif command == CMD_REORDER:
+                data = handleReorder(command_args, state)
             elif command == CMD_CHANGE:
-                response, writer, csvfile = handleChange(
-                    command_args, args, uid, gid, csvfile
-                )
+                data = handleChange(command_args, state)
+            elif command == CMD_STATUS:
+                data = handleStatus(state)
+            elif command == CMD_CANCEL:
+                data = handleCancel(command_args, state)
+            elif command == CMD_SAMPLER:
+                data = handleSampler(command_args, state)
+            elif command == CMD_SAMPLES:
+                data = handleSamples(command_args, state)
             elif command == CMD_EXIT:
-                response, should_exit = handleExit()
+                data = handleExit(state)
             else:
-                conn.sendall(RES_UNKNOWN_COMMAND)
+                raise CommandError(f"Unknown command {command}")
 
-            conn.sendall(response)
-
-            if should_exit:
-                return writer, csvfile, True
+            sendFrame(writer, makeResponse(request_id, command, data))
+            await writer.drain()
 
+        except (ConnectionResetError, BrokenPipeError):
+            break
         except Exception as e:
             log(f"Error while handling client: {e}")
-            conn.sendall(createErrorResponse(last_command, e))
+            sendFrame(writer, makeError(request_id, command, e))
+            # A frame that could not be read leaves the stream out of sync.
+            if request_id is None and not command:
+                break
+
+    state.clients -= 1
+    log("Client disconnected.")
+    writer.close()
+
 
-    return writer, csvfile, False
+def idle(state):
+    return state.clients == 0 and state.current is None and not state.queue
 
 
-def runSocket():
+async def watchIdle(state, timeout):
+    # A persistent worker outlives the GUI, it exits once nobody has been
+    # connected and no job has been queued for timeout seconds.
+    idle_since = None
+    while not state.exit.is_set():
+        await asyncio.sleep(min(timeout, 5.0))
+        if not idle(state):
+            idle_since = None
+        elif idle_since is None:
+            idle_since = time.monotonic()
+        elif time.monotonic() - idle_since >= timeout:
+            log(f"Idle for {timeout:.0f} s, shutting down...")
+            handleExit(state)
+
+
+def detachOutput(path, uid):
+    # The GUI that launched a persistent worker stops reading its stdout
+    # when it closes, later output goes to a log file the user can read.
+    # The path is in /tmp, whatever is already there is only appended to
+    # and handed to the user when it is a plain file of theirs or ours,
+    # anything else (a FIFO, a hard link to another file) is left alone.
+    try:
+        fd = os.open(
+            path,
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_NOFOLLOW | os.O_NONBLOCK,
+            0o600,
+        )
+    except OSError as e:
+        log(f"Cannot log to {path}: {e}, output is discarded")
+        fd = os.open(os.devnull, os.O_WRONLY)
+    else:
+        info = os.fstat(fd)
+        if (
+            not stat.S_ISREG(info.st_mode)
+            or info.st_nlink != 1
+            or info.st_uid not in (0, uid)
+        ):
+            log(f"{path} is not a plain file of this user, output is discarded")
+            os.close(fd)
+            fd = os.open(os.devnull, os.O_WRONLY)
+        else:
+            os.fchown(fd, uid, -1)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(fd, sys.stdout.fileno())
+    os.dup2(fd, sys.stderr.fileno())
+    os.close(fd)
+
+
+async def serve(persistent=False, idle_timeout=WORKER_IDLE_TIMEOUT, log_path=None):
     uid, gid = getOriginalUserIDs()
 
     if os.path.exists(SOCKET_PATH):
         os.remove(SOCKET_PATH)
 
-    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    args = Namespace(iperf_addr="", iperf_port="", target="", out="", iface="")
-    writer, csvfile = None, None
+    state = WorkerState(uid, gid, persistent)
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: handleClient(state, reader, writer), SOCKET_PATH
+    )
+    jobs = asyncio.create_task(runJobs(state))
+    watcher = (
+        asyncio.create_task(watchIdle(state, idle_timeout)) if persistent else None
+    )
 
     try:
-        server.bind(SOCKET_PATH)
         os.chown(SOCKET_PATH, uid, -1)
         os.chmod(SOCKET_PATH, 0o600)
-
         log(f"Socket server listening at {SOCKET_PATH}")
-        server.listen(1)
+        print(READY_LINE, flush=True)
 
-        while True:
-            log("Waiting for connection...")
-            conn, _ = server.accept()
-            log("Client connected.")
+        if persistent:
+            log(f"Persistent, idle timeout {idle_timeout:.0f} s, logging to {log_path}")
+            detachOutput(log_path, uid)
 
-            writer, csvfile, should_exit = handleClient(
-                conn, args, uid, gid, writer, csvfile
-            )
-            if should_exit:
-                break
-
-    except Exception as e:
-        log(f"Server error: {e}", file=sys.stderr)
+        await state.exit.wait()
     finally:
         server.close()
+        jobs.cancel()
+        if watcher is not None:
+            watcher.cancel()
+        if state.sampler is not None:
+            state.sampler.stop()
         if os.path.exists(SOCKET_PATH):
             os.remove(SOCKET_PATH)
-        if csvfile:
-            csvfile.close()
+        if state.storage:
+            state.storage.close()
+
+
+def runSocket(persistent=False, idle_timeout=WORKER_IDLE_TIMEOUT, log_path=None):
+    try:
+        asyncio.run(serve(persistent, idle_timeout, log_path))
+    except Exception as e:
+        log(f"Server error: {e}", file=sys.stderr)
+    finally:
         log("Server shut down")
 
 
 if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Root worker serving measurements over a socket"
+    )
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        help="Keep running after clients disconnect, accepting new connections",
+    )
+    parser.add_argument(
+        "--idle_timeout",
+        type=float,
+        default=WORKER_IDLE_TIMEOUT,
+        help="Seconds without clients or jobs before a persistent worker exits",
+    )
+    parser.add_argument(
+        "--log",
+        default=WORKER_LOG_PATH,
+        help="Output file of a persistent worker once it is detached",
+    )
+    args = parser.parse_args()
+
     if os.getuid() == 0:
         setProcName("Analyser Worker")
-        runSocket()
+        if args.persistent:
+            # Closing the terminal the GUI ran in must not take it down.
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        runSocket(args.persistent, args.idle_timeout, args.log)
     else:
         print("Root priviledges required to run!", file=sys.stderr)
         exit(1)
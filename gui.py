@@ -1,17 +1,39 @@
-from PySide6.QtCore import Qt, QThreadPool, Slot, QPoint, QSize
+from utils.startup import startup
+from PySide6.QtCore import Qt, QThreadPool, Slot, QPoint, QSize, QTimer
 from PySide6.QtGui import QPixmap, QIcon
-from PySide6.QtWidgets import QApplication, QMainWindow, QPushButton, QStyle
+from PySide6.QtWidgets import (
+    QApplication,
+    QMainWindow,
+    QPushButton,
+    QStyle,
+    QToolButton,
+)
 from typing import cast
 
 from ui.ui_main import Ui_MainWindow
 from widgets.ap import AP
+from widgets.heatmap_overlay import HeatmapOverlay
+from widgets.log_view import LogView
 from utils.workers import Worker
-from utils.stream import Stream
+from utils.stream import LogSink
+from utils.protocol import (
+    CMD_START,
+    CMD_START_BATCH,
+    CMD_REORDER,
+    CMD_CHANGE,
+    CMD_STATUS,
+    CMD_CANCEL,
+)
 from utils.literals import (
     PWD,
     DEFAULT_IPERF_PORT,
     DEFAULT_IPERF_ADDRESS,
-    DEFAULT_TARGET
+    DEFAULT_TARGET,
+    MEASURE_FILE_SUFFIXES,
+    MEASURE_OPTION_DEFAULTS,
+    LIVE_HEATMAP_METRIC,
+    LOG_CAPACITY,
+    LOG_STATUS_RATE_HZ,
 )
 from utils.util import (
     makeBackgroundImage,
@@ -25,7 +47,9 @@ from utils.util import (
     getDependencies,
 )
 
-import sys, json
+import sys
+
+startup.mark("imports")
 
 
 class MainWindow(QMainWindow, Ui_MainWindow):
@@ -33,6 +57,23 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         super().__init__()
 
         self.is_running = False
+        self.painted = False
+        self.measure_suffix = MEASURE_FILE_SUFFIXES[
+            "sqlite" if "--sqlite" in sys.argv else "csv"
+        ]
+        # analyser_cli's measurement options, --bidir for a flag and
+        # --parallel=4 for a value. The worker checks them on CHANGE.
+        self.measure_options = {}
+        for arg in sys.argv[1:]:
+            key, _, value = arg.removeprefix("--").partition("=")
+            if arg.startswith("--") and key in MEASURE_OPTION_DEFAULTS:
+                self.measure_options[key] = value or True
+        # Ids of the jobs this window queued, the only ones Stop cancels.
+        self.jobs: set[int] = set()
+        # Buttons of the queued batch jobs by job id, and the buttons of a
+        # batch that was sent but whose job ids have not come back yet.
+        self.batch_buttons: dict[int, QPushButton] = {}
+        self.pending_batch: list[QPushButton] = []
 
         self.setupUi(self)
         self.setFixedSize(1400, 650)
@@ -149,6 +190,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                     QPushButton:pressed  { background-color: rgba(255, 255, 0, 100); }
                 """
 
+        self.queued_button_style = """
+                    QPushButton          { border: 0; background: rgba(255, 165, 0, 70); }
+                    QPushButton:hover    { background-color: rgba(255, 165, 0, 140); }
+                    QPushButton:pressed  { background-color: rgba(255, 165, 0, 140); }
+                """
+
         self.completed_button_style = """
                     QPushButton          { border: 0; background: rgba(0, 255, 0, 100); }
                     QPushButton:hover    { background-color: rgba(0, 255, 0, 100); }
@@ -159,6 +206,16 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             button.clicked.connect(self.roomPartitionClicked)
             button.setStyleSheet(self.default_button_style)
 
+        # Sits between the floor image and the zone buttons.
+        self.heatmap_overlay = HeatmapOverlay(
+            self.floor_view,
+            metric=LIVE_HEATMAP_METRIC,
+            method="idw" if "--interpolate" in sys.argv else "rooms",
+        )
+        self.heatmap_overlay.setGeometry(self.floor_layout.geometry())
+        self.heatmap_overlay.stackUnder(self.fl11)
+        self.heatmap_overlay.setRooms(self.roomBoxes())
+
         self.found_text = "{0} is available!"
         self.not_found_text = "{0} is not available!"
         self.not_found_optional_text = "{0} is not available, but is optional!"
@@ -186,23 +243,46 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             .pixmap(icon_size)
         )
 
-        self.refreshDependencies()
         self.refresh_deps_button.setIcon(QIcon.fromTheme("view-refresh"))
         self.refresh_deps_button.clicked.connect(self.refreshDependencies)
 
         self.aps: list[AP] = []
 
-        self.stream = Stream()
-
-        self.stream.textWritten.connect(self.updateStatus)
-
-        sys.stdout = self.stream
-
-        self.populateFromFile()
-
-        self.worker = Worker()
+        self.log = LogSink(LOG_CAPACITY)
+        sys.stdout = self.log
+
+        # The status bar shows the latest line at most LOG_STATUS_RATE_HZ
+        # times a second however much is printed in between.
+        self.log_sequence = 0
+        self.status_timer = QTimer(self)
+        self.status_timer.setInterval(int(1000 / LOG_STATUS_RATE_HZ))
+        self.status_timer.timeout.connect(self.updateStatus)
+        self.status_timer.start()
+
+        self.log_view = LogView(self.log, LOG_STATUS_RATE_HZ)
+        self.log_button = QToolButton()
+        self.log_button.setText("Log")
+        self.log_button.clicked.connect(self.log_view.show)
+        self.statusBar.addPermanentWidget(self.log_button)  # type: ignore
+
+        self.batch_button = QToolButton()
+        self.batch_button.setText("Measure remaining")
+        self.batch_button.clicked.connect(self.startBatch)
+        self.statusBar.addPermanentWidget(self.batch_button)  # type: ignore
+
+        self.stop_button = QToolButton()
+        self.stop_button.setText("Stop")
+        self.stop_button.setEnabled(False)
+        self.stop_button.clicked.connect(self.cancelMeasurement)
+        self.statusBar.addPermanentWidget(self.stop_button)  # type: ignore
+
+        # The report mode only measures the GUI, it does not ask for root.
+        self.worker = Worker(
+            start=not startup.enabled, persistent="--persistent-worker" in sys.argv
+        )
 
         self.worker.signals.connected.connect(self.updateWorkerArgs)
+        self.worker.signals.connected.connect(self.requestStatus)
 
         self.iperf_addr.textChanged.connect(self.updateWorkerArgs)
         self.iperf_port.textChanged.connect(self.updateWorkerArgs)
@@ -210,20 +290,47 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.interface_combo.currentTextChanged.connect(self.updateWorkerArgs)
 
         self.worker.signals.finished.connect(self.onMeasurementFinish)
+        self.worker.signals.batch_job_finished.connect(self.onBatchJobFinish)
+        self.worker.signals.batch_finished.connect(self.onBatchFinish)
+        self.worker.signals.progress.connect(self.onProgress)
         self.worker.signals.command_error.connect(self.onError)
+        self.worker.signals.response_received.connect(self.onResponse)
+        self.worker.signals.connection_error.connect(self.onConnectionError)
 
         print("Ready")
 
-    def updateStatus(self, text):
-        stripped = text.strip()
-        if stripped and not stripped == "\n":
-            self.statusBar.showMessage(f"Status: {stripped}")  # type: ignore
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            startup.mark("first paint")
+            QTimer.singleShot(0, self.finishStartup)
+
+    def finishStartup(self):
+        # Work the first frame does not need runs once the window is up.
+        self.refreshDependencies()
+        self.populateFromFile()
+        startup.mark("deferred work")
+
+        if startup.enabled:
+            startup.report()
+            self.close()
+
+    def updateStatus(self):
+        if self.log.sequence == self.log_sequence:
+            return
+
+        self.log_sequence = self.log.sequence
+        _, line = self.log.last()
+        self.statusBar.showMessage(f"Status: {line.strip()}")  # type: ignore
 
     def closeEvent(self, event):
         self.worker.stop()
 
         self.onStop()
 
+        self.status_timer.stop()
+        self.log_view.close()
         sys.stdout = sys.__stdout__
 
         event.accept()
@@ -234,11 +341,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             "iperf_port": self.iperf_port.text(),
             "iface": self.interface_combo.currentText(),
             "target": self.ping_target.text(),
-            "out": f"{self.building_value.lower()}{self.floor_value}_measure.csv",
+            "out": f"{self.building_value.lower()}{self.floor_value}{self.measure_suffix}",
             "pwd": PWD,
+            **self.measure_options,
         }
 
-        self.worker.send_command(f"CHANGE {json.dumps(options)}")
+        self.worker.send_command(CMD_CHANGE, options)
 
     def refreshDependencies(self):
         deps = getDependencies()
@@ -282,29 +390,146 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.available_icon if deps["arp-scan"] else self.not_available_icon
         )
 
-    @Slot()
-    def onMeasurementFinish(self):
-        self.last_clicked_button.setStyleSheet(self.completed_button_style)
-        self.buttons[self.last_clicked_button] = True
+    @Slot(dict)
+    def onMeasurementFinish(self, result):
+        self.markFinished(self.last_clicked_button, result)
         self.onStop()
 
         print("Measurement finished succesfully!")
 
+    @Slot(dict)
+    def onBatchJobFinish(self, result):
+        button = self.batch_buttons.pop(result["job"], None)
+        if button is not None:
+            self.markFinished(button, result)
+
+        print(f"Batch measurement {result["index"] + 1}/{result["total"]} finished")
+
+    @Slot(dict)
+    def onBatchFinish(self, summary):
+        self.onStop()
+        print(
+            f"Batch finished: {len(summary["completed"])} completed,"
+            f" {len(summary["failed"])} failed, {len(summary["cancelled"])} cancelled"
+        )
+
+    def markFinished(self, button, result):
+        self.jobs.discard(result.get("job"))
+        button.setStyleSheet(self.completed_button_style)
+        self.buttons[button] = True
+
+        row = result.get("row") or {}
+        if result.get("position"):
+            x, y, pir = result["position"]
+            self.heatmap_overlay.setValue(x, y, pir, row.get(LIVE_HEATMAP_METRIC))
+
+    @Slot()
+    def onProgress(self, event):
+        # The first progress of a batch job marks its point as in progress.
+        button = self.batch_buttons.get(event.get("job"))
+        if button is not None and event["stage"] == "measure":
+            button.setStyleSheet(self.inprogress_button_style)
+
+        if event["stage"] == "iperf3":
+            print(
+                f"{event["direction"].capitalize()}: {event["mbps"]} Mbit/s ({event["end"]:.0f} s)"
+            )
+
     @Slot()
     def onError(self, error):
-        if error["command"] == "START_MEASUREMENT":
-            self.onMeasurementError()
-        self.onStop()
+        data = error.get("data", {})
+        self.jobs.discard(data.get("job"))
+        if error["command"] == CMD_START_BATCH and "job" in data:
+            # One job of the batch, the rest keeps going.
+            button = self.batch_buttons.pop(data["job"], None)
+            if button is not None:
+                self.markFailed(button, data["outcome"])
+            if data["outcome"] == "cancelled":
+                # Counted in the batch summary instead of one line each.
+                return
+        elif error["command"] == CMD_START_BATCH:
+            self.setButtonsStyle(self.default_button_style, self.pending_batch)
+            self.pending_batch = []
+            self.onStop()
+        elif error["command"] == CMD_START:
+            self.markFailed(self.last_clicked_button, data.get("outcome"))
+            self.onStop()
 
         print(f"Error running command {error["command"]}: {error["error"]}")
 
-    def onMeasurementError(self):
-        self.last_clicked_button.setStyleSheet(self.errored_button_style)
-        self.buttons[self.last_clicked_button] = False
+    def markFailed(self, button, outcome):
+        # A cancelled point can simply be measured again.
+        if outcome == "cancelled":
+            button.setStyleSheet(self.default_button_style)
+        else:
+            button.setStyleSheet(self.errored_button_style)
+        self.buttons[button] = False
 
     def onStop(self):
         self.busy_spinner.stop()
         self.is_running = False
+        self.stop_button.setEnabled(False)
+        self.batch_button.setEnabled(True)
+
+    def onStart(self):
+        self.busy_spinner.start()
+        self.is_running = True
+        self.stop_button.setEnabled(True)
+        self.batch_button.setEnabled(False)
+
+    def startBatch(self):
+        if self.is_running or not self.dependenciesMet():
+            return
+
+        # Every point not measured yet, room by room from the left.
+        remaining = sorted(
+            (button for button, done in self.buttons.items() if not done),
+            key=self.buttonPosition,
+        )
+        if not remaining:
+            print("Every point of this floor is measured")
+            return
+
+        self.pending_batch = remaining
+        self.setButtonsStyle(self.queued_button_style, remaining)
+        positions = [list(self.buttonPosition(button)) for button in remaining]
+        self.worker.send_command(CMD_START_BATCH, {"positions": positions})
+        self.onStart()
+        print(f"Queued {len(remaining)} measurements")
+
+    def cancelMeasurement(self):
+        if self.jobs:
+            self.worker.send_command(CMD_CANCEL, {"jobs": sorted(self.jobs)})
+            print("Cancelling measurement...")
+
+    def requestStatus(self):
+        self.worker.send_command(CMD_STATUS)
+
+    @Slot(dict)
+    def onResponse(self, response):
+        if response["command"] == CMD_START:
+            self.jobs.add(response["data"]["job"])
+        elif response["command"] == CMD_START_BATCH:
+            jobs = response["data"]["jobs"]
+            self.jobs.update(jobs)
+            self.batch_buttons.update(zip(jobs, self.pending_batch))
+            self.pending_batch = []
+        elif response["command"] == CMD_STATUS:
+            # A reused worker may still be busy with another session's jobs,
+            # ours are queued behind them.
+            status = response["data"]
+            if status["running"] is not None or status["queued"]:
+                print(
+                    f"Worker busy: job {status['running']} running,"
+                    f" {len(status['queued'])} queued"
+                )
+        elif response["command"] == CMD_CANCEL:
+            print(f"Cancelled {len(response['data']['cancelled'])} job(s)")
+
+    @Slot(str)
+    def onConnectionError(self, message):
+        self.statusBar.showMessage(message)  # type: ignore
+        print(f"Error: {message}")
 
     def generateBackground(self):
         self.repmap = makeRepmap(
@@ -315,8 +540,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         self.floor_layout.setPixmap(self._floor_layout_pixmap)
 
-    def setButtonsStyle(self, stylesheet):
-        for button in self.buttons.keys():
+    def setButtonsStyle(self, stylesheet, buttons=None):
+        for button in self.buttons.keys() if buttons is None else buttons:
             button.setStyleSheet(stylesheet)
 
     def resetParitionState(self):
@@ -324,7 +549,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.buttons[button] = False
 
     def populateFromFile(self):
-        (done, self.aps) = load(self, self.building_value + self.floor_value)
+        (done, self.aps, values) = load(
+            self, self.building_value + self.floor_value, self.measure_suffix
+        )
+
+        self.heatmap_overlay.setPriors(self.apPriors())
+        self.heatmap_overlay.setValues(values)
 
         for button in self.buttons.keys():
             if button.objectName() in done:
@@ -344,10 +574,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.populateFromFile()
         self.updateWorkerArgs()
 
-    def roomPartitionClicked(self):
-        if self.is_running:
-            return
-
+    def dependenciesMet(self):
         deps = getDependencies()
         if not deps["iperf3"] or not deps["ping"] or not deps["nmcli"]:
             not_available = list(
@@ -359,10 +586,28 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             print(
                 f"Required {"dependency" if len(not_available) == 1 else "dependencies"} not met: {', '.join(not_available)}"
             )
-            return
+            return False
+
+        return True
 
+    def roomPartitionClicked(self):
         sender_button = cast(QPushButton, self.sender())
 
+        if self.is_running:
+            # A point still queued in the batch is measured next.
+            queued = [
+                job
+                for job, button in self.batch_buttons.items()
+                if button is sender_button
+            ]
+            if queued:
+                self.worker.send_command(CMD_REORDER, {"jobs": queued})
+                print(f"Moved {sender_button.objectName()} to the front of the queue")
+            return
+
+        if not self.dependenciesMet():
+            return
+
         if sender_button:
             if self.buttons[sender_button]:
                 return
@@ -370,28 +615,62 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.last_clicked_button = sender_button
             sender_button.setStyleSheet(self.inprogress_button_style)
 
-            self.busy_spinner.start()
-
+            x, y, pir = self.buttonPosition(sender_button)
             name = sender_button.objectName()
-            x = int(name[2]) + (0 if name[0] == "f" else 4)
-            y = 0 if name[1] == "l" else 1
-            pir = int(name[3])
 
-            self.worker.send_command(f"START_MEASUREMENT {x},{y},{pir}")
-            self.is_running = True
+            self.worker.send_command(CMD_START, {"position": [x, y, pir]})
+            self.onStart()
             print(f"Started measurements for {self.repmap[name[0:-1]]} ({pir})")
 
+    def buttonPosition(self, button):
+        name = button.objectName()
+        x = int(name[2]) + (0 if name[0] == "f" else 4)
+        y = 0 if name[1] == "l" else 1
+        pir = int(name[3])
+
+        return (x, y, pir)
+
+    def roomBoxes(self):
+        # A room is the union of its three zone buttons, in floor_layout
+        # coordinates.
+        boxes = {}
+        origin = self.floor_layout.pos()
+        for button in self.buttons:
+            x, y, _ = self.buttonPosition(button)
+            rect = button.geometry().translated(-origin)
+            if (x, y) in boxes:
+                rect = boxes[(x, y)].united(rect)
+            boxes[(x, y)] = rect
+
+        return {
+            key: (rect.left(), rect.top(), rect.right() + 1, rect.bottom() + 1)
+            for key, rect in boxes.items()
+        }
+
     def placeNewAP(self, x, y):
         point = self.floor_layout.mapToGlobal(QPoint(x, y))
         ap = AP(self, point)
 
         self.aps.append(ap)
+        self.heatmap_overlay.setPriors(self.apPriors())
 
         saveAPLocation(f"{self.building_value}{self.floor_value}", point.x(), point.y())
 
+    def apPriors(self):
+        # AP locations are saved in screen coordinates, the overlay works in
+        # floor_layout ones. An AP widget is centred on its saved point.
+        priors = []
+        for ap in self.aps:
+            centre = ap.pos() + QPoint(ap.width() // 2, ap.height() // 2)
+            point = self.floor_layout.mapFromGlobal(centre)
+            priors.append((point.x(), point.y()))
+
+        return priors
+
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = MainWindow()
+    startup.mark("window constructed")
     window.show()
     app.exec()
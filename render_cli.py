@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+from utils.heatmap import HEATMAP_METRICS, readMetric, renderHeatmap, decodeImage
+from utils.literals import MEASURE_FILE_SUFFIXES
+from concurrent.futures import ProcessPoolExecutor
+import argparse, os, re, sys, time
+
+FLOOR_PATTERN = re.compile(r"^([a-z]+)(\d+)$", re.I)
+
+# One figure per worker process, cleared and redrawn for every heatmap.
+figure = None
+
+
+def parseArgs():
+    p = argparse.ArgumentParser(
+        description="render heatmaps for every floor and metric without the GUI"
+    )
+    p.add_argument(
+        "--dir",
+        default=".",
+        help=f"directory containing <floor>{'|'.join(MEASURE_FILE_SUFFIXES.values())} files",
+    )
+    p.add_argument(
+        "--metrics",
+        nargs="+",
+        default=["signal_dbm", "download", "upload"],
+        choices=list(HEATMAP_METRICS),
+    )
+    p.add_argument("--out_dir", default="heatmaps")
+    p.add_argument("--alpha", type=float, default=0.5, help="overlay opacity")
+    p.add_argument(
+        "--method",
+        default="rooms",
+        choices=["rooms", "idw", "rbf"],
+        help="shade each room from its thirds, or interpolate the whole floor",
+    )
+    p.add_argument(
+        "--neighbours",
+        type=int,
+        default=None,
+        help="only use this many closest measurements per pixel (idw/rbf)",
+    )
+    p.add_argument(
+        "--grid_step", type=int, default=4, help="interpolation grid spacing in px"
+    )
+    p.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of rendering processes",
+    )
+
+    return p.parse_args(sys.argv[1:])
+
+
+def findFloors(directory):
+    floors = {}
+    for name in sorted(os.listdir(directory)):
+        suffix = next(
+            (s for s in MEASURE_FILE_SUFFIXES.values() if name.endswith(s)), None
+        )
+        if suffix is None:
+            continue
+        floor = name.removesuffix(suffix)
+        if not FLOOR_PATTERN.match(floor):
+            print(f"Skipping {name}, {floor} is not a <building><floor> name")
+            continue
+        if floor in floors:
+            print(f"Skipping {name}, {floor} is already read from {floors[floor]}")
+            continue
+        floors[floor] = os.path.join(directory, name)
+
+    return floors
+
+
+def loadFloorImage(floor):
+    # Runs in the pool so floors are rasterised in parallel. Qt and cairosvg
+    # are imported here rather than at module level, so only the pool
+    # processes that draw a floor load them.
+    from utils.util import makeBackgroundImage, makeRepmap
+
+    building, number = FLOOR_PATTERN.match(floor).groups()
+    replace_map = makeRepmap(building=building.upper(), floor=int(number))
+    return decodeImage(makeBackgroundImage(replace_map=replace_map))
+
+
+def renderOne(floor, path, metric, image, alpha, out_dir, method, interpolation):
+    global figure
+    if figure is None:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        figure = Figure(figsize=(12, 6))
+        FigureCanvasAgg(figure)
+
+    data = readMetric(path, metric)
+    if not data:
+        return (floor, metric, None)
+
+    value_name, value_ext, vmin, vmax, invert = HEATMAP_METRICS[metric]
+    out = os.path.join(out_dir, f"{floor}_{metric}.png")
+    renderHeatmap(
+        figure,
+        image,
+        data,
+        overlay_alpha=alpha,
+        value_name=value_name,
+        value_ext=value_ext,
+        vmin=vmin,
+        vmax=vmax,
+        out=out,
+        method=method,
+        interpolation=interpolation,
+        invert=invert,
+    )
+    return (floor, metric, out)
+
+
+def render(args):
+    floors = findFloors(args.dir)
+    if not floors:
+        print(f"No measurement files in {args.dir}")
+        return
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    interpolation = {"neighbours": args.neighbours, "step": args.grid_step}
+    start = time.monotonic()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # Every floor image is rasterised and decoded exactly once, the pixels
+        # are then handed to each metric of that floor.
+        images = dict(zip(floors, pool.map(loadFloorImage, floors)))
+
+        jobs = [
+            pool.submit(
+                renderOne,
+                floor,
+                path,
+                metric,
+                images[floor],
+                args.alpha,
+                args.out_dir,
+                args.method,
+                interpolation,
+            )
+            for floor, path in floors.items()
+            for metric in args.metrics
+        ]
+
+        rendered = 0
+        for job in jobs:
+            floor, metric, out = job.result()
+            if out is None:
+                print(f"{floor}: no {metric} values, skipped")
+            else:
+                rendered += 1
+                print(f"{floor}: {metric} -> {out}")
+
+    print(f"Rendered {rendered} heatmaps in {time.monotonic() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    render(parseArgs())
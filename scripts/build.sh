@@ -4,4 +4,4 @@ set -euo pipefail
 
 bash convert_ui.sh
 
-pyinstaller ../gui.py --add-data "../analyser_server.py:." --add-data "../utils/analyser_utils.py:./utils" --add-data "../utils/literals.py:./utils" --add-data "../media/floor_template.svg:./media" --add-data "../media/mouse_right_click.png:./media" --onefile --windowed -n WifiAnalyser
\ No newline at end of file
+pyinstaller ../gui.py --add-data "../analyser_server.py:." --add-data "../utils/analyser_utils.py:./utils" --add-data "../utils/literals.py:./utils" --add-data "../utils/icmp.py:./utils" --add-data "../utils/iperf.py:./utils" --add-data "../utils/linkstats.py:./utils" --add-data "../utils/ntp.py:./utils" --add-data "../utils/neighbours.py:./utils" --add-data "../utils/storage.py:./utils" --add-data "../utils/protocol.py:./utils" --add-data "../utils/sampler.py:./utils" --add-data "../utils/trace.py:./utils" --add-data "../media/floor_template.svg:./media" --add-data "../media/mouse_right_click.png:./media" --onefile --windowed -n WifiAnalyser
\ No newline at end of file
@@ -1,21 +1,49 @@
-import statistics, re, subprocess, datetime, os, json
+from concurrent.futures import ThreadPoolExecutor
+from utils.icmp import ping
+from utils.iperf import measureSession
+from utils.linkstats import LinkStats
+from utils.ntp import ClockSyncProbe
+from utils.neighbours import NeighbourTable, sweepLock
+from utils.trace import tracing, span, run, bound, appendTrace, tracePath
+
+import statistics, re, subprocess, datetime, shlex, socket
 
 
 def currentTime():
     return datetime.datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S")
 
 def runCMD(cmd, timeout: float | None = 3):
-    res = subprocess.run(
-        cmd,  # type: ignore
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        timeout=timeout,
-    )  # type: ignore
+    # Run without a shell, so the trace times the program itself and not
+    # /bin/sh, and the interface and target are never shell parsed.
+    # A missing program or a timeout comes back as the shell's exit codes.
+    try:
+        res = run(
+            shlex.split(cmd),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=timeout,
+        )  # type: ignore
+    except FileNotFoundError:
+        return ("", 127)
+    except subprocess.TimeoutExpired:
+        return ("", 124)
     return (res.stdout.strip(), res.returncode)
 
+linkStats = LinkStats()
+
+def qualityToDbm(quality):
+    # NetworkManager maps -100..-50 dBm linearly onto 0..100 %.
+    try:
+        return str(round(int(quality) / 2 - 100))
+    except ValueError:
+        return ""
+
 def parseNmcli(iface):
+    link = linkStats.read(iface)
+    if link is not None and link.get("bssid"):
+        return link
+
     data = {
         "ssid": "",
         "bssid": "",
@@ -27,6 +55,9 @@ def parseNmcli(iface):
 
     print("Parsing nmcli...")
 
+    if link is not None:
+        data.update(link)
+
     out, rc = runCMD(
         f"nmcli -t -f IN-USE,SSID,BSSID,FREQ,CHAN,RATE,SIGNAL dev wifi list ifname {iface}",
         timeout=None,
@@ -51,73 +82,28 @@ def parseNmcli(iface):
             data["freq_mhz"] = freq.replace(" MHz", "").strip()
             data["channel"] = chan.strip()
             data["txrate"] = rate.replace(" Mbit/s", "").strip()
-            data["signal_dbm"] = signal.strip()
+            # nmcli's SIGNAL is a 0-100 quality, the dBm from /proc wins.
+            if not data["signal_dbm"]:
+                data["signal_dbm"] = qualityToDbm(signal.strip())
             break
 
     return data
 
-def getInetAndSubnet(iface):
-    inet = ""
-    subnet = 0
-    try:
-        out = subprocess.check_output(["ip", "addr", "show", iface]).decode()
-        regex = re.compile(r"inet\s+([0-9.]+)\/([0-9]+)", re.M)
-        match = regex.match(out)
-        if match is not None: (inet, subnet) = match.groups()
-    except FileNotFoundError:
-        print("Command ip not found, cannot get wireless interfaces.")
-    finally:
-        return (inet, subnet)
+neighbourTables: dict[str, NeighbourTable] = {}
 
 def getArpDevicesCount(iface):
     print("Getting the number of connected devices...")
-    (inet, subnet) = getInetAndSubnet(iface)
-    inet = re.sub(r'^((?:\d{1,3}\.){3})\d{1,3}$', r'\g<1>0', inet)
-    cmd = f"arp-scan -x {inet}/{subnet}"
-    out, rc = runCMD(cmd=cmd, timeout=15)
-    if rc != 0 or not out:
+    if iface not in neighbourTables:
+        neighbourTables[iface] = NeighbourTable(iface)
+        neighbourTables[iface].start()
+
+    count = neighbourTables[iface].getCount()
+    if count < 0:
         print("Failed to get devices via arp-scan!")
 
-        return -1
-    count = len(out.split("\n"))
     return count
 
-def measureLatency(target, count=10, timeout=1):
-    print("Measuring latency, jitter, packet loss...")
-    cmd = f"ping -c {count} -W {timeout} {target}"
-    out, rc = runCMD(cmd, timeout=count + 5)
-    if rc != 0 or not out:
-        print(f"Latency measure failed: out={out}; rc={rc}")
-
-        return {
-            "avg_ms": None,
-            "min_ms": None,
-            "max_ms": None,
-            "jitter_ms": None,
-            "loss_pct": 100.0,
-            "success": False,
-        }
-
-    latencies = []
-    transmitted = received = 0
-
-    for line in out.splitlines():
-        if "time=" in line:
-            try:
-                lat = float(line.split("time=")[1].split()[0])
-                latencies.append(lat)
-                received += 1
-            except Exception:
-                pass
-        elif "packets transmitted" in line and "received" in line:
-            parts = line.split(",")
-            if len(parts) >= 2:
-                try:
-                    transmitted = int(parts[0].split()[0])
-                    received = int(parts[1].split()[0])
-                except Exception:
-                    pass
-
+def summariseLatencies(latencies, transmitted, received):
     loss_pct = 100.0
     if transmitted > 0:
         loss_pct = 100.0 * (transmitted - received) / transmitted
@@ -144,73 +130,199 @@ def measureLatency(target, count=10, timeout=1):
         "success": success,
     }
 
-def testSpeed(server="speedtest.fra1.de.leaseweb.net", port="5201-5210", duration=10):
+def measureLatency(target, count=10, timeout=1, interval=0.1):
+    print("Measuring latency, jitter, packet loss...")
+    try:
+        res = ping(target, count=count, interval=interval, timeout=timeout)
+    except socket.gaierror as e:
+        # ping could not resolve it either.
+        print(f"Could not resolve {target}: {e}")
+        return summariseLatencies([], 0, 0)
+    except PermissionError as e:
+        print(f"ICMP socket unavailable ({e}), falling back to ping...")
+        return measureLatencyWithPing(target, count=count, timeout=timeout)
+    except OSError as e:
+        print(f"Latency measure failed: {e}")
+        return summariseLatencies([], 0, 0)
+
+    latencies = [rtt for _, _, rtt in res["samples"] if rtt is not None]
+    return summariseLatencies(latencies, res["transmitted"], len(latencies))
+
+def measureLatencyWithPing(target, count=10, timeout=1):
+    cmd = f"ping -c {count} -W {timeout} {target}"
+    out, rc = runCMD(cmd, timeout=count + 5)
+    if rc != 0 or not out:
+        print(f"Latency measure failed: out={out}; rc={rc}")
 
-    print(f"Running iperf3 speed test to {server}...")
+        return summariseLatencies([], 0, 0)
 
-    def run_iperf3(reverse=False):
-        cmd = [
-            "iperf3",
-            "-c",
-            server,
-            "-J",
-            "-t",
-            str(duration),
-            "--connect-timeout",
-            "3000",
-        ]
+    latencies = []
+    transmitted = received = 0
+
+    for line in out.splitlines():
+        if "time=" in line:
+            try:
+                lat = float(line.split("time=")[1].split()[0])
+                latencies.append(lat)
+                received += 1
+            except Exception:
+                pass
+        elif "packets transmitted" in line and "received" in line:
+            parts = line.split(",")
+            if len(parts) >= 2:
+                try:
+                    transmitted = int(parts[0].split()[0])
+                    received = int(parts[1].split()[0])
+                except Exception:
+                    pass
 
-        if not port == "":
-            cmd += [
-                "-p",
-                port,
-            ]
+    return summariseLatencies(latencies, transmitted, received)
+
+def testSpeed(
+    server="speedtest.fra1.de.leaseweb.net",
+    port="5201-5210",
+    duration=10,
+    progress=None,
+    adaptive=False,
+    min_duration=3,
+    confidence=0.95,
+    precision_pct=5.0,
+    bidir=False,
+    parallel=1,
+):
 
-        if reverse:
-            cmd.append("-R")
+    print(f"Running iperf3 speed test to {server}...")
 
-        res = subprocess.run(cmd, capture_output=True, text=True, timeout=duration + 5)
-        if res.returncode != 0:
-            raise RuntimeError(res.stderr.strip())
-        data = json.loads(res.stdout)
-        bps_field = "sum_received" if reverse else "sum_sent"
-        bps = data["end"][bps_field]["bits_per_second"]
-        return round(bps / 1_000_000, 2)
+    def run_iperf3(mode):
+        return measureSession(
+            server,
+            port,
+            mode=mode,
+            duration=duration,
+            progress=progress,
+            adaptive=adaptive,
+            min_duration=min_duration,
+            confidence=confidence,
+            precision_pct=precision_pct,
+            interval=0.5 if adaptive else 1.0,
+            parallel=parallel,
+        )
+
+    results = None
+    if bidir:
+        try:
+            results = run_iperf3("bidir")
+        except RuntimeError as e:
+            bidir = False
+            print(f"Bidirectional test failed ({e}), falling back to sequential...")
+
+    if results is None:
+        results = run_iperf3("download") | run_iperf3("upload")
+
+    if progress is not None:
+        progress(
+            {
+                "stage": "iperf3_summary",
+                "bidir": bidir,
+                "results": results,
+            }
+        )
 
-    download = run_iperf3(reverse=True)
-    upload = run_iperf3(reverse=False)
+    return {
+        "download": results["download"]["mbps"],
+        "upload": results["upload"]["mbps"],
+        "download_ci_pct": results["download"]["ci_pct"],
+        "upload_ci_pct": results["upload"]["ci_pct"],
+    }
 
-    return (download, upload)
+clockSync = ClockSyncProbe()
 
-def checkNTPSync() -> bool:
+def checkNTPSync(ttl: float | None = None) -> bool:
     print("Is ntp synced?")
 
-    out, _ = runCMD("timedatectl show -p NTPSynchronized --value 2>/dev/null")
-    if out.strip().lower() == "yes":
-        return True
+    if ttl is not None:
+        clockSync.ttl = ttl
 
-    out, _ = runCMD("chronyc tracking | grep 'Leap status' || true")
-    if "normal" in out.lower():
-        return True
+    return clockSync.get()
 
-    out, _ = runCMD("ntpq -p 2>/dev/null | grep '^*' || true")
-    if out.strip():
-        return True
+def timedStage(name, stage):
+    with span(name):
+        return stage()
 
-    if os.path.exists("/etc/adjtime"):
-        return True
+def runConcurrently(stages):
+    with ThreadPoolExecutor(max_workers=len(stages)) as pool:
+        futures = {
+            name: pool.submit(bound(timedStage), name, stage)
+            for name, stage in stages.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+def measure(args, row, storage, progress=None):
+    # With args.trace every stage and subprocess is timed and appended to a
+    # Chrome trace-event file next to args.out.
+    with tracing(args.trace) as tracer:
+        position = [
+            row.get(k) for k in ("position_x", "position_y", "position_in_room")
+        ]
+        try:
+            # A neighbour sweep in flight finishes first, no new one starts.
+            with sweepLock, span("measure", position=position):
+                measureStages(args, row, progress)
+                with span("store"):
+                    storage.append(row)
+        finally:
+            # A failed or cancelled measurement is the one worth looking at.
+            if tracer is not None:
+                appendTrace(tracePath(args.out), tracer)
 
-    print("No way to check ntp status, assuming it isn't synced...")
+    print("Measurement done")
 
-    return False
+def measureStages(args, row, progress=None):
+    def report(step):
+        if progress is not None:
+            progress({"stage": "measure", "step": step})
 
-def measure(args, row, writer, csvfile):
-    ntp_ok = checkNTPSync()
     ts = currentTime()
-    wifi = parseNmcli(args.iface)
-    device_count = getArpDevicesCount(args.iface)
-    ping_stats = measureLatency(args.target)
-    (download, upload) = testSpeed(server=args.iperf_addr, port=args.iperf_port)
+
+    # These stages only read local state or probe the LAN, so they can overlap.
+    # Latency and throughput stages would skew each other and run exclusively.
+    concurrent_stages = {
+        "ntp_ok": lambda: checkNTPSync(ttl=args.ntp_ttl),
+        "wifi": lambda: parseNmcli(args.iface),
+        "device_count": lambda: getArpDevicesCount(args.iface),
+    }
+    if args.concurrent_ping:
+        concurrent_stages["ping_stats"] = lambda: measureLatency(
+            args.target, interval=args.ping_interval
+        )
+
+    report("concurrent")
+    results = runConcurrently(concurrent_stages)
+    ntp_ok = results["ntp_ok"]
+    wifi = results["wifi"]
+    device_count = results["device_count"]
+
+    if "ping_stats" in results:
+        ping_stats = results["ping_stats"]
+    else:
+        report("latency")
+        with span("ping_stats"):
+            ping_stats = measureLatency(args.target, interval=args.ping_interval)
+
+    report("speed")
+    with span("speed"):
+        speed = testSpeed(
+            server=args.iperf_addr,
+            port=args.iperf_port,
+            duration=args.max_duration,
+            progress=progress,
+            adaptive=args.adaptive,
+            min_duration=args.min_duration,
+            confidence=args.confidence,
+            precision_pct=args.precision_pct,
+            bidir=args.bidir,
+            parallel=args.parallel,
+        )
 
     row.update(
         {  # pyright: ignore[reportArgumentType, reportCallIssue]
@@ -229,14 +341,11 @@ def measure(args, row, writer, csvfile):
             "ping_jitter_ms": ping_stats["jitter_ms"],
             "ping_loss_pct": ping_stats["loss_pct"],
             "ping_success": 1 if ping_stats["success"] else 0,
-            "download": download,
-            "upload": upload,
+            "download": speed["download"],
+            "upload": speed["upload"],
+            "download_ci_pct": speed["download_ci_pct"],
+            "upload_ci_pct": speed["upload_ci_pct"],
             "ntp_synced": "yes" if ntp_ok else "no",
             "num_of_connected_devices": device_count
         }
     )
-
-    writer.writerow(row)
-    csvfile.flush()
-
-    print("Measurement done")
@@ -0,0 +1,160 @@
+from utils.literals import APS_FILE, MEASURE_FILE_SUFFIX, LIVE_HEATMAP_METRIC
+from utils.storage import openStorage, readCsvSince, POSITION_COLUMNS
+
+import json, os
+
+INDEX_VERSION = 2
+
+
+def fileSignature(paths):
+    stats = [os.stat(path) for path in paths if os.path.exists(path)]
+    return [
+        sum(stat.st_size for stat in stats),
+        max((stat.st_mtime_ns for stat in stats), default=0),
+    ]
+
+
+def isAppendOnly(old, new):
+    # A file that shrank, or was rewritten in place with the same size, can
+    # not be caught up from the old cursor and has to be parsed again.
+    return new[0] > old[0] or new == old
+
+
+def emptyEntry():
+    return {"signature": [0, 0], "cursor": 0, "rows": 0, "items": [], "values": []}
+
+
+# Per-floor summary of the measurement and AP files kept in a hidden sidecar
+# next to the measurement file, so switching floors only parses rows that
+# were appended since the last visit. The latest value of one metric is kept
+# per position as well, for the live heatmap.
+class FloorIndex:
+    def __init__(
+        self,
+        location,
+        directory=".",
+        aps_path=APS_FILE,
+        metric=LIVE_HEATMAP_METRIC,
+        suffix=MEASURE_FILE_SUFFIX,
+    ):
+        self.location = location
+        self.metric = metric
+        self.measure_path = os.path.join(directory, f"{location.lower()}{suffix}")
+        self.aps_path = aps_path
+        self.path = os.path.join(directory, f".{location.lower()}{suffix}.index.json")
+        self.data = self.read()
+        self.positions = {tuple(item) for item in self.data["measure"]["items"]}
+        self.values = {
+            tuple(item[:3]): item[3] for item in self.data["measure"]["values"]
+        }
+
+    def read(self):
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+            if (
+                data.get("version") == INDEX_VERSION
+                and data.get("metric") == self.metric
+            ):
+                return data
+        except (OSError, ValueError):
+            pass
+
+        return {
+            "version": INDEX_VERSION,
+            "metric": self.metric,
+            "measure": emptyEntry(),
+            "aps": emptyEntry(),
+        }
+
+    def write(self):
+        self.data["measure"]["items"] = sorted(self.positions)
+        self.data["measure"]["values"] = [
+            [*position, value] for position, value in sorted(self.values.items())
+        ]
+        try:
+            with open(self.path, "w") as file:
+                json.dump(self.data, file)
+        except OSError as e:
+            print(f"Could not write floor index {self.path}: {e}")
+
+    def refreshMeasurements(self):
+        entry = self.data["measure"]
+        if not os.path.exists(self.measure_path):
+            if entry["rows"]:
+                self.data["measure"] = emptyEntry()
+                self.positions = set()
+                self.values = {}
+                return True
+            return False
+
+        storage = openStorage(self.measure_path, readonly=True)
+        try:
+            signature = fileSignature(storage.files())
+            if signature == entry["signature"]:
+                return False
+            if not isAppendOnly(entry["signature"], signature):
+                entry = self.data["measure"] = emptyEntry()
+                self.positions = set()
+                self.values = {}
+
+            rows, entry["cursor"] = storage.readSince(entry["cursor"])
+        finally:
+            storage.close()
+
+        for row in rows:
+            position = tuple(row[key] for key in POSITION_COLUMNS)
+            if None not in position:
+                self.positions.add(position)
+                if row.get(self.metric) is not None:
+                    self.values[position] = row[self.metric]
+        entry["rows"] += len(rows)
+        entry["signature"] = signature
+        return True
+
+    def refreshAps(self):
+        entry = self.data["aps"]
+        if not os.path.exists(self.aps_path):
+            if entry["rows"]:
+                self.data["aps"] = emptyEntry()
+                return True
+            return False
+
+        signature = fileSignature([self.aps_path])
+        if signature == entry["signature"]:
+            return False
+        if not isAppendOnly(entry["signature"], signature):
+            entry = self.data["aps"] = emptyEntry()
+
+        rows, entry["cursor"] = readCsvSince(self.aps_path, entry["cursor"])
+        for row in rows:
+            if row["floor"] == self.location:
+                entry["items"].append([int(row["x"]), int(row["y"])])
+        entry["rows"] += len(rows)
+        entry["signature"] = signature
+        return True
+
+    def refresh(self):
+        changed = self.refreshMeasurements()
+        changed = self.refreshAps() or changed
+        if changed:
+            self.write()
+
+    def measurementValues(self):
+        return [(*position, value) for position, value in self.values.items()]
+
+    def apPoints(self):
+        return [tuple(point) for point in self.data["aps"]["items"]]
+
+
+floorIndexes: dict[str, FloorIndex] = {}
+
+
+def getFloorIndex(location, directory=".", suffix=MEASURE_FILE_SUFFIX):
+    key = os.path.join(os.path.abspath(directory), location + suffix)
+    if key not in floorIndexes:
+        floorIndexes[key] = FloorIndex(location, directory, suffix=suffix)
+
+    index = floorIndexes[key]
+    index.refresh()
+    return index
@@ -0,0 +1,46 @@
+import hashlib, os, re
+
+PLACEHOLDER = re.compile(r"\{([A-Za-z0-9_]+)\}")
+
+
+# The floor SVG split once into literal chunks and the placeholder names
+# between them, rendering a floor is a single join instead of one full copy
+# of the document per str.replace.
+class FloorTemplate:
+    def __init__(self, text: str, remove: tuple[str, ...] = ()):
+        for literal in remove:
+            text = text.replace(literal, "")
+
+        parts = PLACEHOLDER.split(text)
+        self.chunks = parts[0::2]
+        self.slots = parts[1::2]
+        self.digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def render(self, values: dict[str, str], defaults: dict[str, str] = {}) -> str:
+        # Placeholders without a value are left in the output as they were.
+        parts = [self.chunks[0]]
+        for name, chunk in zip(self.slots, self.chunks[1:]):
+            value = values.get(name, defaults.get(name))
+            parts.append(f"{{{name}}}" if value is None else value)
+            parts.append(chunk)
+
+        return "".join(parts)
+
+
+templates: dict[tuple, tuple[tuple[int, int], FloorTemplate]] = {}
+
+
+def loadTemplate(path: str, remove: tuple[str, ...] = ()) -> FloorTemplate:
+    # Compiled once per file, again only if it changed on disk.
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    key = (os.path.abspath(path), remove)
+
+    cached = templates.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with open(path, "r", encoding="utf-8") as file:
+        template = FloorTemplate(file.read(), remove)
+    templates[key] = (signature, template)
+    return template
@@ -0,0 +1,338 @@
+from PIL import Image
+from matplotlib.colors import Normalize, LinearSegmentedColormap
+from matplotlib.cm import ScalarMappable
+from matplotlib.figure import Figure
+from utils.storage import openStorage, POSITION_COLUMNS
+from utils.interpolation import GridInterpolator, measurementPoints
+
+import numpy as np
+
+LUT_SIZE = 256
+HEATMAP_CMAP = LinearSegmentedColormap.from_list("rg", ["r", "y", "g"], N=LUT_SIZE)
+
+# Metric column -> (label, unit, vmin, vmax, invert), None bounds follow the
+# data. Inverted metrics are better when lower and run green to red.
+HEATMAP_METRICS = {
+    "signal_dbm": ("Signal strength (dbm)", "dbm", -90, -30, False),
+    "download": ("Download speed (Mbps)", "Mbps", 10, 1000, False),
+    "upload": ("Upload speed (Mbps)", "Mbps", 10, 1000, False),
+    "ping_avg_ms": ("Average latency (ms)", "ms", None, None, True),
+    "ping_jitter_ms": ("Jitter (ms)", "ms", None, None, True),
+    "ping_loss_pct": ("Packet loss (%)", "%", None, None, True),
+    "tx_bitrate_mbps": ("Link bitrate (Mbps)", "Mbps", None, None, False),
+    "num_of_connected_devices": ("Connected devices", "", None, None, True),
+}
+
+
+def metricColormap(invert: bool = False):
+    return HEATMAP_CMAP.reversed() if invert else HEATMAP_CMAP
+
+
+# Pixel boxes (left, top, right, bottom) of the rooms on the rendered floor
+# template, keyed by the (position_x, position_y) of the measurements. x runs
+# 1..8 from the left like the GUI buttons (f*1..f*4, s*1..s*4) record it.
+ROOM_BBOXES = {
+    (1, 0): (364, 194, 522, 482),
+    (2, 0): (522, 194, 680, 482),
+    (3, 0): (680, 194, 838, 482),
+    (4, 0): (838, 194, 996, 482),
+    (5, 0): (1016, 194, 1174, 482),
+    (6, 0): (1174, 194, 1332, 482),
+    (7, 0): (1332, 194, 1490, 482),
+    (8, 0): (1490, 194, 1648, 482),
+    (1, 1): (364, 598, 522, 887),
+    (2, 1): (522, 598, 680, 887),
+    (3, 1): (680, 598, 838, 887),
+    (4, 1): (838, 598, 996, 887),
+    (5, 1): (1016, 598, 1174, 887),
+    (6, 1): (1174, 598, 1332, 887),
+    (7, 1): (1332, 598, 1490, 887),
+    (8, 1): (1490, 598, 1648, 887),
+}
+
+
+def readMetric(path: str, value_key: str) -> list[tuple[int, int, int, float]]:
+    storage = openStorage(path, readonly=True)
+    data = []
+    try:
+        for row in storage.rows():
+            point = tuple(row[key] for key in POSITION_COLUMNS) + (row[value_key],)
+            if None not in point:
+                data.append(point)
+    finally:
+        storage.close()
+
+    return data
+
+
+def makeColorLut(cmap=HEATMAP_CMAP, alpha: float = 0.5) -> np.ndarray:
+    # Integer input indexes the colormap table directly, so the lookup gives
+    # the same colors as calling cmap(norm(v)) for every value.
+    lut = np.rint(cmap(np.arange(LUT_SIZE)) * 255).astype(np.uint8)
+    lut[:, 3] = int(round(alpha * 255))
+    return lut
+
+
+def collectRoomValues(data) -> dict[tuple[int, int], np.ndarray]:
+    rooms: dict[tuple[int, int], np.ndarray] = {}
+    for x, y, pir, value in data:
+        if pir not in (1, 2, 3):
+            print(f"Warning: pir={pir} out of range")
+            continue
+        rooms.setdefault((x, y), np.full(3, np.nan))[pir - 1] = value
+
+    return rooms
+
+
+def fillMissing(values: np.ndarray, fallback: float) -> np.ndarray:
+    # A missing third takes the value before it, then the one after it.
+    values = values.copy()
+    for i in range(len(values)):
+        if np.isnan(values[i]) and i > 0:
+            values[i] = values[i - 1]
+    for i in reversed(range(len(values) - 1)):
+        if np.isnan(values[i]):
+            values[i] = values[i + 1]
+
+    values[np.isnan(values)] = fallback
+    return values
+
+
+def interpolateRooms(thirds: np.ndarray, heights: np.ndarray) -> np.ndarray:
+    # Linear interpolation of every room's three values over its pixel rows
+    # at once, row k of a room of height h sits at k / (h - 1) of the room.
+    # Rows past a room's own height are never read.
+    rows = np.arange(heights.max())
+    position = rows[None, :] / np.maximum(heights - 1, 1)[:, None]
+    segment = np.clip(position, 0, 1) * (thirds.shape[1] - 1)
+    low = np.minimum(segment.astype(int), thirds.shape[1] - 2)
+    weight = segment - low
+
+    take = np.take_along_axis
+    return (
+        take(thirds, low, axis=1) * (1 - weight)
+        + take(thirds, low + 1, axis=1) * weight
+    )
+
+
+def lutIndices(values: np.ndarray, vmin: float, vmax: float) -> np.ndarray:
+    normed = (values - vmin) / (vmax - vmin)
+    return np.clip((normed * LUT_SIZE).astype(int), 0, LUT_SIZE - 1)
+
+
+def renderGridOverlay(
+    size: tuple[int, int],
+    data: list[tuple[int, int, int, float]],
+    bboxes: dict[tuple[int, int], tuple[int, int, int, int]],
+    vmin: float,
+    vmax: float,
+    lut: np.ndarray,
+    method: str = "idw",
+    step: int = 4,
+    priors=None,
+    **options,
+) -> np.ndarray:
+    # Floor-wide overlay from a GridInterpolator evaluated every step pixels,
+    # each grid cell is then blown up to a step x step block.
+    W, H = size
+    points, values = measurementPoints(data, bboxes)
+    if not len(values):
+        return np.zeros((H, W, 4), dtype=np.uint8)
+
+    grid = GridInterpolator(
+        points, values, method=method, priors=priors, **options
+    ).grid(W, H, step)
+    colors = lut[lutIndices(grid, vmin, vmax)]
+    return np.ascontiguousarray(
+        colors.repeat(step, axis=0).repeat(step, axis=1)[:H, :W]
+    )
+
+
+def renderOverlay(
+    size: tuple[int, int],
+    rooms: dict[tuple[int, int], np.ndarray],
+    bboxes: dict[tuple[int, int], tuple[int, int, int, int]],
+    vmin: float,
+    vmax: float,
+    lut: np.ndarray,
+) -> tuple[np.ndarray, dict[tuple[int, int], float]]:
+    W, H = size
+    overlay = np.zeros((H, W, 4), dtype=np.uint8)
+    averages = paintRooms(overlay, rooms, bboxes, vmin, vmax, lut)
+    return (overlay, averages)
+
+
+def paintRooms(
+    overlay: np.ndarray,
+    rooms: dict[tuple[int, int], np.ndarray],
+    bboxes: dict[tuple[int, int], tuple[int, int, int, int]],
+    vmin: float,
+    vmax: float,
+    lut: np.ndarray,
+) -> dict[tuple[int, int], float]:
+    # Only the boxes of the given rooms are written, the rest of the overlay
+    # is left as it was.
+    keys, thirds = roomThirds(rooms, bboxes, vmin)
+    if not keys:
+        return {}
+
+    boxes = np.array([bboxes[key] for key in keys])
+    heights = boxes[:, 3] - boxes[:, 1]
+
+    colors = lut[lutIndices(interpolateRooms(thirds, heights), vmin, vmax)]
+
+    for n, (left, top, right, bottom) in enumerate(boxes):
+        overlay[top:bottom, left:right] = colors[n, : bottom - top, None, :]
+
+    return roomAverages(keys, thirds)
+
+
+def roomThirds(
+    rooms: dict[tuple[int, int], np.ndarray],
+    bboxes: dict[tuple[int, int], tuple[int, int, int, int]],
+    fallback: float,
+) -> tuple[list[tuple[int, int]], np.ndarray]:
+    # The three values of every room on the floor, top to bottom.
+    keys = []
+    for key in rooms:
+        if key not in bboxes:
+            print(f"({key[0]},{key[1]}) is out-of-bounds")
+            continue
+        keys.append(key)
+    if not keys:
+        return (keys, np.empty((0, 3)))
+
+    thirds = np.array([fillMissing(rooms[key], fallback) for key in keys])
+    # Rooms on the far side of the corridor are numbered from the door.
+    flipped = np.array([key[1] == 1 for key in keys])
+    thirds[flipped] = thirds[flipped, ::-1]
+    return (keys, thirds)
+
+
+def roomAverages(
+    keys: list[tuple[int, int]], thirds: np.ndarray
+) -> dict[tuple[int, int], float]:
+    return {key: float(np.mean(thirds[n])) for n, key in enumerate(keys)}
+
+
+def drawHeatmap(
+    fig: Figure,
+    img: Image.Image | np.ndarray,
+    overlay: np.ndarray,
+    averages: dict[tuple[int, int], float],
+    bboxes: dict[tuple[int, int], tuple[int, int, int, int]],
+    norm: Normalize,
+    cmap=HEATMAP_CMAP,
+    value_name: str = "",
+    value_ext: str = "",
+):
+    ax = fig.subplots()
+
+    for key, avg_val in averages.items():
+        left, top, right, bottom = bboxes[key]
+        ax.text(
+            (left + right) / 2,
+            bottom + 20,
+            f"{avg_val:.1f} {value_ext}",
+            ha="center",
+            va="top",
+            color="black",
+            fontsize=10,
+            fontweight="bold",
+            bbox=dict(facecolor="none", alpha=0.6, edgecolor="none", pad=1),
+        )
+
+    ax.imshow(img)
+    ax.imshow(overlay)
+    ax.axis("off")
+
+    sm = ScalarMappable(norm=norm, cmap=cmap)
+    sm.set_array([])
+    cbar = fig.colorbar(sm, ax=ax, fraction=0.07, pad=-0.05, location="bottom")
+    cbar.set_label(value_name)
+
+    fig.tight_layout()
+
+
+def renderHeatmap(
+    fig: Figure,
+    img: np.ndarray,
+    data: list[tuple[int, int, int, float]],
+    bboxes: dict[tuple[int, int], tuple[int, int, int, int]] = ROOM_BBOXES,
+    overlay_alpha: float = 0.5,
+    value_name: str = "",
+    value_ext: str = "",
+    vmin: float | None = None,
+    vmax: float | None = None,
+    out: str = "plot.png",
+    method: str = "rooms",
+    interpolation: dict = {},
+    invert: bool = False,
+):
+    # img is the decoded RGBA floor image, fig is cleared and drawn into so a
+    # caller rendering many heatmaps can keep reusing the same one. method
+    # "rooms" shades every room from its three thirds, "idw" and "rbf" fill
+    # the whole floor with GridInterpolator using the interpolation options.
+    vals = np.array([v for *_, v in data], dtype=float)
+    vmin = vals.min() if vmin is None else vmin
+    vmax = vals.max() if vmax is None else vmax
+    if vmin == vmax:
+        vmin -= 1.0
+
+    cmap = metricColormap(invert)
+    lut = makeColorLut(cmap, overlay_alpha)
+    size = (img.shape[1], img.shape[0])
+    rooms = collectRoomValues(data)
+    if method == "rooms":
+        overlay, averages = renderOverlay(size, rooms, bboxes, vmin, vmax, lut)
+    else:
+        # The room labels still show the measured averages.
+        overlay = renderGridOverlay(
+            size, data, bboxes, vmin, vmax, lut, method=method, **interpolation
+        )
+        averages = roomAverages(*roomThirds(rooms, bboxes, vmin))
+
+    fig.clear()
+    drawHeatmap(
+        fig,
+        img,
+        overlay,
+        averages,
+        bboxes,
+        Normalize(vmin=vmin, vmax=vmax),
+        cmap=cmap,
+        value_name=value_name,
+        value_ext=value_ext,
+    )
+    fig.savefig(out)
+
+
+def decodeImage(base_image) -> np.ndarray:
+    return np.asarray(Image.open(base_image).convert("RGBA"))
+
+
+def produceImage(
+    base_image,
+    overlay_alpha: float = 0.5,
+    bboxes: dict[tuple[int, int], tuple[int, int, int, int]] = ROOM_BBOXES,
+    data: list[tuple[int, int, int, float]] = [],
+    value_name: str = "",
+    value_ext: str = "",
+    vmin: float | None = None,
+    vmax: float | None = None,
+    out: str = "plot.png",
+    invert: bool = False,
+):
+    renderHeatmap(
+        Figure(figsize=(12, 6)),
+        decodeImage(base_image),
+        data,
+        bboxes,
+        overlay_alpha=overlay_alpha,
+        value_name=value_name,
+        value_ext=value_ext,
+        vmin=vmin,
+        vmax=vmax,
+        out=out,
+        invert=invert,
+    )
@@ -0,0 +1,130 @@
+import asyncio, itertools, os, socket, statistics, struct, time
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+PAYLOAD_SIZE = 32
+
+# Raw sockets see every echo reply of the host. Each pingAsync call gets its
+# own identifier and payload, so concurrent pingers in one process (the
+# sampler next to a measurement) never take each other's replies.
+pingers = itertools.count(1)
+
+
+def makePayload(token: bytes) -> bytes:
+    return (b"wifi_analyser" + token).ljust(PAYLOAD_SIZE, b"\0")
+
+
+def checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def makeEchoRequest(ident: int, seq: int, payload: bytes) -> bytes:
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = checksum(header + payload)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, csum, ident, seq) + payload
+
+
+def openIcmpSocket():
+    # Unprivileged datagram ICMP sockets need net.ipv4.ping_group_range to
+    # include our group, raw sockets need root; try the cheaper one first.
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        is_raw = False
+    except PermissionError:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        is_raw = True
+
+    sock.setblocking(False)
+    return (sock, is_raw)
+
+
+def isJitterStable(latencies, min_samples, tolerance_ms, window=3):
+    if len(latencies) < max(min_samples, window + 2):
+        return False
+
+    jitters = [
+        statistics.stdev(latencies[:n])
+        for n in range(len(latencies) - window, len(latencies) + 1)
+    ]
+    return max(jitters) - min(jitters) <= tolerance_ms
+
+
+async def pingAsync(
+    target,
+    count=10,
+    interval=0.1,
+    timeout=1.0,
+    min_samples=5,
+    stable_tolerance_ms=0.2,
+):
+    loop = asyncio.get_running_loop()
+    addr = (await loop.getaddrinfo(target, None, family=socket.AF_INET))[0][4][0]
+
+    sock, is_raw = openIcmpSocket()
+    ident = (os.getpid() + next(pingers)) & 0xFFFF
+    payload = makePayload(os.urandom(8))
+    sent_at: dict[int, float] = {}
+    rtts: dict[int, float] = {}
+    latencies: list[float] = []
+
+    async def receive():
+        while True:
+            data = await loop.sock_recv(sock, 1024)
+            received_at = time.monotonic()
+
+            if is_raw:
+                data = data[(data[0] & 0x0F) * 4 :]
+            if len(data) < 8:
+                continue
+
+            icmp_type, _, _, reply_ident, seq = struct.unpack("!BBHHH", data[:8])
+            if icmp_type != ICMP_ECHO_REPLY:
+                continue
+            # The kernel rewrites the identifier of datagram ICMP sockets and
+            # only delivers our own replies, so it is only checked on raw ones.
+            if is_raw and reply_ident != ident:
+                continue
+            if data[8:] != payload:
+                continue
+            if seq not in sent_at or seq in rtts:
+                continue
+            if received_at - sent_at[seq] > timeout:
+                continue
+
+            rtts[seq] = (received_at - sent_at[seq]) * 1000
+            latencies.append(rtts[seq])
+
+    receiver = asyncio.create_task(receive())
+    try:
+        for seq in range(count):
+            packet = makeEchoRequest(ident, seq, payload)
+            sent_at[seq] = time.monotonic()
+            await loop.sock_sendto(sock, packet, (addr, 0))
+
+            if isJitterStable(latencies, min_samples, stable_tolerance_ms):
+                break
+
+            await asyncio.sleep(interval)
+
+        deadline = sent_at[len(sent_at) - 1] + timeout
+        while len(rtts) < len(sent_at) and time.monotonic() < deadline:
+            await asyncio.sleep(0.005)
+    finally:
+        receiver.cancel()
+        sock.close()
+
+    return {
+        "transmitted": len(sent_at),
+        "samples": [(seq, ts, rtts.get(seq)) for seq, ts in sent_at.items()],
+    }
+
+
+def ping(target, count=10, interval=0.1, timeout=1.0, **kwargs):
+    return asyncio.run(
+        pingAsync(target, count=count, interval=interval, timeout=timeout, **kwargs)
+    )
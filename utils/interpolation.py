@@ -0,0 +1,227 @@
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+# Kernels take the squared distance already divided by epsilon squared and
+# may overwrite it, which saves a square root and a temporary per block.
+def gaussian(s):
+    # Clipped before exp, underflowing into subnormals is very slow and
+    # exp(-50) is already nothing next to the samples that matter.
+    np.minimum(s, 50, out=s)
+    return np.exp(np.negative(s, out=s), out=s)
+
+
+def multiquadric(s):
+    return np.sqrt(np.add(s, 1, out=s), out=s)
+
+
+def inverseMultiquadric(s):
+    return np.reciprocal(multiquadric(s), out=s)
+
+
+def thinPlate(s):
+    # r^2 log r == s log(s) / 2, zero at the sample itself.
+    return 0.5 * s * np.log(np.maximum(s, 1e-300))
+
+
+RBF_KERNELS = {
+    "gaussian": gaussian,
+    "multiquadric": multiquadric,
+    "inverse_multiquadric": inverseMultiquadric,
+    "thin_plate": thinPlate,
+}
+
+
+def measurementPoints(
+    data: list[tuple[int, int, int, float]],
+    bboxes: dict[tuple[int, int], tuple[int, int, int, int]],
+) -> tuple[np.ndarray, np.ndarray]:
+    # Places each (x, y, position_in_room, value) at the centre of its third
+    # of the room, counted from the window like the GUI buttons are.
+    points, values = [], []
+    for x, y, pir, value in data:
+        if (x, y) not in bboxes or pir not in (1, 2, 3):
+            continue
+        left, top, right, bottom = bboxes[(x, y)]
+        third = pir - 1 if y == 0 else 3 - pir
+        points.append(((left + right) / 2, top + (third + 0.5) * (bottom - top) / 3))
+        values.append(value)
+
+    return (np.array(points, dtype=float).reshape(-1, 2), np.array(values, dtype=float))
+
+
+def squaredDistances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    distances = a @ b.T
+    distances *= -2
+    distances += (a**2).sum(axis=1)[:, None]
+    distances += (b**2).sum(axis=1)[None, :]
+    return np.maximum(distances, 0, out=distances)
+
+
+# Interpolates scattered (x, y, value) samples onto arbitrary query points or
+# a whole floor grid. Queries are evaluated in chunks of at most chunk_size
+# distances so memory stays flat no matter the grid size.
+#
+# With neighbours set only the closest samples of every query are used,
+# through a KD-tree when scipy is installed. For RBF this truncates the sum,
+# which is only sensible for the decaying kernels.
+#
+# AP positions can be passed as priors: pseudo-samples carrying prior_value
+# (the best measured value by default) with prior_weight relative to a real
+# sample, so coverage between sparse measurements bends towards the APs.
+class GridInterpolator:
+    def __init__(
+        self,
+        points,
+        values,
+        method: str = "idw",
+        power: float = 2.0,
+        neighbours: int | None = None,
+        kernel: str = "gaussian",
+        epsilon: float | None = None,
+        smoothing: float = 0.0,
+        priors=None,
+        prior_value: float | None = None,
+        prior_weight: float = 0.5,
+        chunk_size: int = 1 << 22,
+    ):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        values = np.asarray(values, dtype=float).reshape(-1)
+        valid = ~np.isnan(values)
+        points, values = points[valid], values[valid]
+        if not len(values):
+            raise ValueError("No samples to interpolate")
+
+        weights = np.ones(len(values))
+        if priors is not None and len(priors):
+            priors = np.asarray(priors, dtype=float).reshape(-1, 2)
+            value = values.max() if prior_value is None else prior_value
+            points = np.vstack([points, priors])
+            values = np.concatenate([values, np.full(len(priors), value)])
+            weights = np.concatenate([weights, np.full(len(priors), prior_weight)])
+
+        if method not in ("idw", "rbf"):
+            raise ValueError(f"Unknown interpolation method {method}")
+        if method == "rbf" and kernel not in RBF_KERNELS:
+            raise ValueError(f"Unknown RBF kernel {kernel}")
+
+        self.points = points
+        self.values = values
+        self.weights = weights
+        self.method = method
+        self.power = power
+        self.neighbours = (
+            None if neighbours is None else max(1, min(neighbours, len(values)))
+        )
+        self.kernel = kernel
+        self.smoothing = smoothing
+        self.chunk_size = chunk_size
+        self.tree = cKDTree(points) if cKDTree is not None and self.neighbours else None
+
+        if method == "rbf":
+            self.epsilon = epsilon or self._defaultEpsilon()
+            self._fitRbf()
+
+    def _defaultEpsilon(self) -> float:
+        # Mean distance to the nearest other sample, the usual shape scale.
+        if len(self.points) < 2:
+            return 1.0
+        nearest = []
+        for chunk in self._chunks(len(self.points), len(self.points)):
+            distances = squaredDistances(self.points[chunk], self.points)
+            distances[np.arange(len(distances)), chunk] = np.inf
+            nearest.append(np.sqrt(distances.min(axis=1)))
+        epsilon = float(np.mean(np.concatenate(nearest)))
+        return epsilon if np.isfinite(epsilon) and epsilon > 0 else 1.0
+
+    def _fitRbf(self):
+        # Solved around the mean so the surface falls back to it far from
+        # every sample, lower weights get more smoothing.
+        self.offset = float(np.average(self.values, weights=self.weights))
+        phi = self._kernel(squaredDistances(self.points, self.points))
+        phi[np.diag_indices_from(phi)] += self.smoothing / self.weights + (
+            1 / self.weights - 1
+        )
+        try:
+            self.coefficients = np.linalg.solve(phi, self.values - self.offset)
+        except np.linalg.LinAlgError:
+            self.coefficients = np.linalg.lstsq(
+                phi, self.values - self.offset, rcond=None
+            )[0]
+
+    def _kernel(self, squared: np.ndarray) -> np.ndarray:
+        squared /= self.epsilon**2
+        return RBF_KERNELS[self.kernel](squared)
+
+    def _chunks(self, count: int, width: int):
+        step = max(1, self.chunk_size // max(width, 1))
+        for start in range(0, count, step):
+            yield np.arange(start, min(start + step, count))
+
+    def _nearest(self, query: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Squared distances and indices of the closest samples.
+        k = self.neighbours
+        if self.tree is not None:
+            distances, indices = self.tree.query(query, k=k)
+            distances = distances.reshape(len(query), k)
+            return (distances**2, indices.reshape(len(query), k))
+
+        distances = squaredDistances(query, self.points)
+        if k < len(self.points):
+            indices = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            indices = np.broadcast_to(np.arange(k), distances.shape).copy()
+        return (np.take_along_axis(distances, indices, axis=1), indices)
+
+    def _neighbourhood(self, query: np.ndarray):
+        if self.neighbours is None:
+            return (squaredDistances(query, self.points), None)
+        return self._nearest(query)
+
+    def _idw(self, query: np.ndarray) -> np.ndarray:
+        distances, indices = self._neighbourhood(query)
+        weights = self.weights if indices is None else self.weights[indices]
+        values = self.values if indices is None else self.values[indices]
+
+        if self.power != 2:
+            distances **= self.power / 2
+        with np.errstate(divide="ignore"):
+            inverse = np.divide(weights, distances, out=distances)
+        # A query sitting on a sample takes its value exactly.
+        exact = np.isinf(inverse)
+        hit = exact.any(axis=1)
+        inverse[hit] = exact[hit].astype(float)
+
+        if indices is None:
+            return (inverse @ values) / inverse.sum(axis=1)
+        return (inverse * values).sum(axis=1) / inverse.sum(axis=1)
+
+    def _rbf(self, query: np.ndarray) -> np.ndarray:
+        distances, indices = self._neighbourhood(query)
+        phi = self._kernel(distances)
+        if indices is None:
+            return phi @ self.coefficients + self.offset
+        return (phi * self.coefficients[indices]).sum(axis=1) + self.offset
+
+    def evaluate(self, query) -> np.ndarray:
+        query = np.asarray(query, dtype=float).reshape(-1, 2)
+        evaluate = self._idw if self.method == "idw" else self._rbf
+        # Without a tree the neighbour search still measures every sample.
+        width = self.neighbours if self.tree is not None else len(self.points)
+
+        result = np.empty(len(query))
+        for chunk in self._chunks(len(query), width):
+            result[chunk] = evaluate(query[chunk])
+        return result
+
+    def grid(self, width: int, height: int, step: int = 1) -> np.ndarray:
+        # Values at the centres of step x step cells, shaped (rows, columns).
+        xs = np.arange(0, width, step) + (step - 1) / 2
+        ys = np.arange(0, height, step) + (step - 1) / 2
+        gx, gy = np.meshgrid(xs, ys)
+        query = np.column_stack([gx.ravel(), gy.ravel()])
+        return self.evaluate(query).reshape(len(ys), len(xs))
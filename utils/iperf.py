@@ -0,0 +1,344 @@
+from utils.trace import span, outputSize
+
+import json, math, re, statistics, subprocess, threading, time
+
+OMIT_SECONDS = 1.0
+
+# (interval sum key, end sum key, end stream side) for each direction of a
+# test mode; bidirectional runs report the reverse half under *_bidir_reverse.
+MODE_DIRECTIONS = {
+    "download": {"download": ("sum", "sum_received", "receiver")},
+    "upload": {"upload": ("sum", "sum_sent", "sender")},
+    "bidir": {
+        "download": ("sum_bidir_reverse", "sum_received_bidir_reverse", "receiver"),
+        "upload": ("sum", "sum_sent", "sender"),
+    },
+}
+
+
+def makeIperf3Command(server, port, duration, mode="upload", interval=1.0, parallel=1):
+    cmd = [
+        "iperf3",
+        "-c",
+        server,
+        "-t",
+        str(duration),
+        "-i",
+        str(interval),
+        "--connect-timeout",
+        "3000",
+    ]
+
+    if not port == "":
+        cmd += [
+            "-p",
+            port,
+        ]
+
+    if parallel > 1:
+        cmd += ["-P", str(parallel)]
+
+    if mode == "download":
+        cmd.append("-R")
+    elif mode == "bidir":
+        cmd.append("--bidir")
+
+    return cmd
+
+
+def makeSamples(interval, mode):
+    return [
+        makeSample(interval[sum_key], direction)
+        for direction, (sum_key, _, _) in MODE_DIRECTIONS[mode].items()
+        if sum_key in interval
+    ]
+
+
+def makeSample(interval_sum, direction):
+    return {
+        "stage": "iperf3",
+        "direction": direction,
+        "start": round(interval_sum["start"], 2),
+        "end": round(interval_sum["end"], 2),
+        "mbps": round(interval_sum["bits_per_second"] / 1_000_000, 2),
+    }
+
+
+# Interval and summary lines of iperf3's text output with -f m, e.g.
+# "[  5]   1.00-2.00   sec   112 MBytes   941 Mbits/sec    0    409 KBytes"
+# "[SUM][RX-C]   0.00-10.00  sec  1.10 GBytes   941 Mbits/sec      receiver"
+TEXT_LINE = re.compile(
+    r"^\[\s*(?P<id>\d+|SUM)\](?:\[(?P<role>[TR]X-C)\])?\s+"
+    r"(?P<start>[\d.]+)-\s*(?P<end>[\d.]+)\s+sec\s+\S+\s+\S*Bytes\s+"
+    r"(?P<mbps>[\d.]+)\s+Mbits/sec(?P<rest>.*)$"
+)
+
+# None until the first run tells whether iperf3 knows --json-stream (3.17+).
+json_stream_supported: bool | None = None
+
+
+class TextParser:
+    # Turns the text output of an iperf3 build without --json-stream into
+    # the same samples and "end" object the JSON stream gives.
+    def __init__(self, mode, parallel):
+        self.mode = mode
+        # Single stream runs have no [SUM] lines, the stream is the sum.
+        self.summed = parallel > 1
+        self.summary = False
+        self.end = {"streams": []}
+        self.streams: dict[str, dict] = {}
+
+    def direction(self, role):
+        if self.mode == "bidir":
+            return "download" if role == "RX-C" else "upload"
+        return self.mode
+
+    def feed(self, line):
+        match = TEXT_LINE.match(line)
+        if match is None:
+            return []
+
+        is_sum = match["id"] == "SUM" or not self.summed
+        result = {"bits_per_second": float(match["mbps"]) * 1_000_000}
+        # Only the summary lines end in the side they were measured on.
+        side = (match["rest"].split() or [""])[-1]
+        if side not in ("sender", "receiver"):
+            if not is_sum:
+                return []
+            interval_sum = {
+                **result,
+                "start": float(match["start"]),
+                "end": float(match["end"]),
+            }
+            return [makeSample(interval_sum, self.direction(match["role"]))]
+
+        self.summary = True
+        if is_sum:
+            key = "sum_sent" if side == "sender" else "sum_received"
+            if match["role"] == "RX-C":
+                key += "_bidir_reverse"
+            self.end[key] = result
+        if match["id"] != "SUM":
+            stream = self.streams.setdefault(match["id"], {})
+            if not stream:
+                self.end["streams"].append(stream)
+            stream[side] = {
+                **result,
+                "socket": int(match["id"]),
+                "sender": match["role"] != "RX-C",
+            }
+        return []
+
+
+def spawnStreaming(cmd, timeout, info):
+    # Spawn overhead as trace.run records it, the watchdog kills a run that
+    # hangs past its duration.
+    start = time.perf_counter_ns()
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+    )
+    info["spawn_ms"] = (time.perf_counter_ns() - start) / 1e6
+    watchdog = threading.Timer(timeout, proc.kill)
+    watchdog.start()
+    return (proc, watchdog)
+
+
+def finishStreaming(proc, watchdog):
+    watchdog.cancel()
+    if proc.poll() is None:
+        proc.terminate()
+    proc.stdout.close()
+    stderr = proc.stderr.read()
+    proc.stderr.close()
+    return (proc.wait(), stderr)
+
+
+def streamIperf3Json(cmd, mode, timeout):
+    end = None
+    error = None
+    streamed = False
+    size = 0
+    with span("exec iperf3", mode=mode) as info:
+        proc, watchdog = spawnStreaming(
+            cmd + ["--json-stream", "--forceflush"], timeout, info
+        )
+        try:
+            for line in proc.stdout:  # type: ignore
+                size += outputSize(line)
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                streamed = True
+                if event.get("event") == "interval":
+                    yield from makeSamples(event["data"], mode)
+                elif event.get("event") == "end":
+                    end = event["data"]
+                elif event.get("event") == "error":
+                    error = event["data"]
+        finally:
+            rc, stderr = finishStreaming(proc, watchdog)
+            info["stdout_bytes"] = size
+
+    if not streamed and "json-stream" in stderr:
+        return None
+
+    if error is not None or rc != 0 or end is None:
+        raise RuntimeError(error or stderr.strip() or f"iperf3 exited with {rc}")
+
+    return end
+
+
+def streamIperf3Text(cmd, mode, timeout, parallel):
+    parser = TextParser(mode, parallel)
+    size = 0
+    with span("exec iperf3", mode=mode) as info:
+        proc, watchdog = spawnStreaming(
+            cmd + ["-f", "m", "--forceflush"], timeout, info
+        )
+        try:
+            for line in proc.stdout:  # type: ignore
+                size += outputSize(line)
+                yield from parser.feed(line)
+        finally:
+            rc, stderr = finishStreaming(proc, watchdog)
+            info["stdout_bytes"] = size
+
+    if rc != 0 or not parser.summary:
+        raise RuntimeError(stderr.strip() or f"iperf3 exited with {rc}")
+
+    return parser.end
+
+
+# Yields per-interval samples as iperf3 reports them and returns the final
+# "end" object. iperf3 builds without --json-stream (before 3.17) have their
+# text output parsed line by line instead, which streams just the same.
+def streamIperf3(server, port, duration, mode="upload", interval=1.0, parallel=1):
+    global json_stream_supported
+
+    cmd = makeIperf3Command(server, port, duration, mode, interval, parallel)
+    timeout = duration + 5
+
+    if json_stream_supported is not False:
+        end = yield from streamIperf3Json(cmd, mode, timeout)
+        if end is not None:
+            json_stream_supported = True
+            return end
+        json_stream_supported = False
+
+    return (yield from streamIperf3Text(cmd, mode, timeout, parallel))
+
+
+def tQuantile(confidence, dof):
+    # Cornish-Fisher expansion of Student's t around the normal quantile,
+    # accurate to a few percent from 3 degrees of freedom upwards.
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    return z + (z**3 + z) / (4 * dof) + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * dof**2)
+
+
+def confidenceHalfWidthPct(values, confidence=0.95):
+    if len(values) < 2:
+        return None
+
+    mean = statistics.mean(values)
+    if mean <= 0:
+        return None
+
+    half_width = tQuantile(confidence, len(values) - 1) * statistics.stdev(values)
+    return 100 * half_width / math.sqrt(len(values)) / mean
+
+
+def getStreamResults(end, mode):
+    streams = []
+    for stream in end.get("streams", []):
+        sender = stream.get("sender", {})
+        if mode == "bidir":
+            direction = "upload" if sender.get("sender", True) else "download"
+        else:
+            direction = mode
+
+        side = MODE_DIRECTIONS[mode][direction][2]
+        streams.append(
+            {
+                "socket": stream.get(side, {}).get("socket"),
+                "direction": direction,
+                "mbps": round(
+                    stream.get(side, {}).get("bits_per_second", 0) / 1_000_000, 2
+                ),
+            }
+        )
+
+    return streams
+
+
+def measureSession(
+    server,
+    port,
+    mode="upload",
+    duration=10,
+    progress=None,
+    adaptive=False,
+    min_duration=3,
+    confidence=0.95,
+    precision_pct=5.0,
+    interval=1.0,
+    parallel=1,
+):
+    directions = MODE_DIRECTIONS[mode]
+    samples = streamIperf3(server, port, duration, mode, interval, parallel)
+    values = {direction: [] for direction in directions}
+    ci_pct = {direction: None for direction in directions}
+
+    try:
+        while True:
+            try:
+                sample = next(samples)
+            except StopIteration as stop:
+                end = stop.value
+                break
+
+            if progress is not None:
+                progress(sample)
+
+            # The first second is TCP slow start and would only widen the bound.
+            if sample["start"] < OMIT_SECONDS:
+                continue
+
+            direction = sample["direction"]
+            values[direction].append(sample["mbps"])
+            ci_pct[direction] = confidenceHalfWidthPct(values[direction], confidence)
+
+            # Converging on the last interval saves nothing, iperf3's own
+            # summary of the whole run is then the better figure.
+            if (
+                adaptive
+                and min_duration <= sample["end"] < duration
+                and all(
+                    ci is not None and ci <= precision_pct for ci in ci_pct.values()
+                )
+            ):
+                return {
+                    direction: {
+                        "mbps": round(statistics.mean(values[direction]), 2),
+                        "ci_pct": round(ci_pct[direction], 2),  # type: ignore
+                        "streams": [],
+                    }
+                    for direction in directions
+                }
+    finally:
+        samples.close()
+
+    streams = getStreamResults(end, mode)
+    return {
+        direction: {
+            "mbps": round(end[end_key]["bits_per_second"] / 1_000_000, 2),
+            "ci_pct": None if ci_pct[direction] is None else round(ci_pct[direction], 2),  # type: ignore
+            "streams": [s for s in streams if s["direction"] == direction],
+        }
+        for direction, (_, end_key, _) in directions.items()
+    }
@@ -0,0 +1,215 @@
+import os, socket, struct, threading
+
+NETLINK_GENERIC = 16
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+NL80211_CMD_GET_INTERFACE = 5
+NL80211_CMD_GET_STATION = 17
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_MAC = 6
+NL80211_ATTR_STA_INFO = 21
+NL80211_ATTR_WIPHY_FREQ = 38
+NL80211_ATTR_SSID = 52
+NL80211_STA_INFO_SIGNAL = 7
+NL80211_STA_INFO_TX_BITRATE = 8
+NL80211_RATE_INFO_BITRATE = 1
+NL80211_RATE_INFO_BITRATE32 = 5
+
+NLMSGHDR = struct.Struct("=IHHII")
+GENLMSGHDR = struct.Struct("=BBH")
+NLATTR = struct.Struct("=HH")
+
+
+def freqToChannel(freq: int) -> int:
+    if freq == 2484:
+        return 14
+    if 2412 <= freq < 2484:
+        return (freq - 2407) // 5
+    if 5955 <= freq <= 7115:
+        return (freq - 5950) // 5
+    if 5000 <= freq < 5955:
+        return (freq - 5000) // 5
+    if 58320 <= freq <= 70200:
+        return (freq - 56160) // 2160
+    return 0
+
+
+def packAttr(attr_type: int, payload: bytes) -> bytes:
+    attr = NLATTR.pack(NLATTR.size + len(payload), attr_type) + payload
+    return attr + b"\0" * (-len(attr) % 4)
+
+
+def parseAttrs(data: bytes) -> dict[int, bytes]:
+    attrs = {}
+    offset = 0
+    while offset + NLATTR.size <= len(data):
+        length, attr_type = NLATTR.unpack_from(data, offset)
+        if length < NLATTR.size:
+            break
+        attrs[attr_type & 0x3FFF] = data[offset + NLATTR.size : offset + length]
+        offset += (length + 3) & ~3
+    return attrs
+
+
+class Nl80211:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+        self.sock.bind((0, 0))
+        self.seq = 0
+        self.family = self._resolveFamily()
+
+    def close(self):
+        self.sock.close()
+
+    def _request(self, msg_type: int, cmd: int, attrs: bytes, flags: int = 0):
+        self.seq += 1
+        payload = GENLMSGHDR.pack(cmd, 1, 0) + attrs
+        header = NLMSGHDR.pack(
+            NLMSGHDR.size + len(payload), msg_type, NLM_F_REQUEST | flags, self.seq, 0
+        )
+        self.sock.send(header + payload)
+
+        messages = []
+        while True:
+            data = self.sock.recv(65536)
+            offset = 0
+            while offset + NLMSGHDR.size <= len(data):
+                length, nl_type, _, seq, _ = NLMSGHDR.unpack_from(data, offset)
+                body = data[offset + NLMSGHDR.size : offset + length]
+                offset += (length + 3) & ~3
+
+                if seq != self.seq:
+                    continue
+                if nl_type == NLMSG_DONE:
+                    return messages
+                if nl_type == NLMSG_ERROR:
+                    (error,) = struct.unpack_from("=i", body)
+                    if error:
+                        raise OSError(-error, os.strerror(-error))
+                    return messages
+
+                messages.append(parseAttrs(body[GENLMSGHDR.size :]))
+                if not flags & NLM_F_DUMP:
+                    return messages
+
+    def _resolveFamily(self) -> int:
+        reply = self._request(
+            GENL_ID_CTRL,
+            CTRL_CMD_GETFAMILY,
+            packAttr(CTRL_ATTR_FAMILY_NAME, b"nl80211\0"),
+        )
+        return struct.unpack("=H", reply[0][CTRL_ATTR_FAMILY_ID][:2])[0]
+
+    def getInterface(self, ifindex: int):
+        attrs = packAttr(NL80211_ATTR_IFINDEX, struct.pack("=I", ifindex))
+        reply = self._request(self.family, NL80211_CMD_GET_INTERFACE, attrs)
+        return reply[0] if reply else {}
+
+    def getStations(self, ifindex: int):
+        attrs = packAttr(NL80211_ATTR_IFINDEX, struct.pack("=I", ifindex))
+        return self._request(self.family, NL80211_CMD_GET_STATION, attrs, NLM_F_DUMP)
+
+
+# Reads the current association straight from the kernel without triggering
+# a scan: nl80211 for the full set of fields, /proc/net/wireless for just the
+# signal level when generic netlink is unavailable.
+class LinkStats:
+    def __init__(self):
+        self.nl = None
+        self.lock = threading.Lock()
+
+    def _netlink(self):
+        if self.nl is None:
+            self.nl = Nl80211()
+        return self.nl
+
+    def isWireless(self, iface: str) -> bool:
+        return os.path.isdir(f"/sys/class/net/{iface}/wireless") or os.path.isdir(
+            f"/sys/class/net/{iface}/phy80211"
+        )
+
+    def readNl80211(self, iface: str):
+        ifindex = socket.if_nametoindex(iface)
+        nl = self._netlink()
+
+        interface = nl.getInterface(ifindex)
+        stations = nl.getStations(ifindex)
+        if not stations:
+            return None
+
+        station = stations[0]
+        info = parseAttrs(station.get(NL80211_ATTR_STA_INFO, b""))
+        data = {
+            "ssid": interface.get(NL80211_ATTR_SSID, b"").decode("utf-8", "replace"),
+            "bssid": ":".join(f"{b:02X}" for b in station.get(NL80211_ATTR_MAC, b"")),
+            "freq_mhz": "",
+            "channel": "",
+            "txrate": "",
+            "signal_dbm": "",
+        }
+
+        if NL80211_ATTR_WIPHY_FREQ in interface:
+            freq = struct.unpack("=I", interface[NL80211_ATTR_WIPHY_FREQ][:4])[0]
+            data["freq_mhz"] = str(freq)
+            data["channel"] = str(freqToChannel(freq))
+
+        if NL80211_STA_INFO_SIGNAL in info:
+            data["signal_dbm"] = str(
+                struct.unpack("=b", info[NL80211_STA_INFO_SIGNAL][:1])[0]
+            )
+
+        rate = parseAttrs(info.get(NL80211_STA_INFO_TX_BITRATE, b""))
+        if NL80211_RATE_INFO_BITRATE32 in rate:
+            bitrate = struct.unpack("=I", rate[NL80211_RATE_INFO_BITRATE32][:4])[0]
+            data["txrate"] = f"{bitrate / 10:g}"
+        elif NL80211_RATE_INFO_BITRATE in rate:
+            bitrate = struct.unpack("=H", rate[NL80211_RATE_INFO_BITRATE][:2])[0]
+            data["txrate"] = f"{bitrate / 10:g}"
+
+        return data
+
+    def readProcWireless(self, iface: str):
+        try:
+            with open("/proc/net/wireless", "r") as file:
+                lines = file.readlines()[2:]
+        except OSError:
+            return None
+
+        for line in lines:
+            name, _, fields = line.partition(":")
+            if name.strip() != iface:
+                continue
+
+            # status, link quality, signal level, noise level, ...
+            parts = fields.split()
+            if len(parts) < 3:
+                return None
+
+            return {"signal_dbm": str(int(float(parts[2].rstrip("."))))}
+
+        return None
+
+    def read(self, iface: str):
+        if not self.isWireless(iface):
+            return None
+
+        with self.lock:
+            try:
+                data = self.readNl80211(iface)
+                if data is not None:
+                    return data
+            except OSError as e:
+                print(f"nl80211 unavailable ({e}), reading /proc/net/wireless...")
+                if self.nl is not None:
+                    self.nl.close()
+                    self.nl = None
+
+        return self.readProcWireless(iface)
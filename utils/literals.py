@@ -1,6 +1,13 @@
 import os
 
 SOCKET_PATH = "/tmp/wifi_analyser.sock"
+# Includes the time spent in the pkexec/sudo password prompt.
+WORKER_READY_TIMEOUT = 120.0
+# How long a running worker gets to answer STATUS before it counts as stale.
+WORKER_STATUS_TIMEOUT = 5.0
+# Persistent worker (gui.py --persistent-worker), see analyser_server.py.
+WORKER_IDLE_TIMEOUT = 30 * 60.0
+WORKER_LOG_PATH = "/tmp/wifi_analyser.log"
 PWD = os.getcwd()
 
 MEASURE_HEADERS = [
@@ -25,12 +32,72 @@ MEASURE_HEADERS = [
     "position_y",
     "position_in_room",
     "ntp_synced",
-    "num_of_connected_devices"
+    "num_of_connected_devices",
+    "download_ci_pct",
+    "upload_ci_pct",
 ]
 
+MEASURE_TYPES = {
+    "freq_mhz": int,
+    "channel": int,
+    "signal_dbm": int,
+    "tx_bitrate_mbps": float,
+    "ping_avg_ms": float,
+    "ping_min_ms": float,
+    "ping_max_ms": float,
+    "ping_jitter_ms": float,
+    "ping_loss_pct": float,
+    "ping_success": int,
+    "download": float,
+    "upload": float,
+    "position_x": int,
+    "position_y": int,
+    "position_in_room": int,
+    "num_of_connected_devices": int,
+    "download_ci_pct": float,
+    "upload_ci_pct": float,
+}
+
+# Measurement file per floor, the storage backend follows the extension.
+# The GUI stores into SQLite when started with --sqlite.
+MEASURE_FILE_SUFFIXES = {"csv": "_measure.csv", "sqlite": "_measure.db"}
+MEASURE_FILE_SUFFIX = MEASURE_FILE_SUFFIXES["csv"]
+
 APS_FILE: str = os.path.join(PWD, "ap_locations.csv")
 APS_HEADERS = ["floor", "x", "y"]
 
 DEFAULT_IPERF_ADDRESS = "a205.speedtest.wobcom.de"
 DEFAULT_IPERF_PORT = ""
-DEFAULT_TARGET = "1.1.1.1"
\ No newline at end of file
+DEFAULT_TARGET = "1.1.1.1"
+
+MEASURE_OPTION_DEFAULTS = {
+    "concurrent_ping": False,
+    "ping_interval": 0.1,
+    "adaptive": False,
+    "min_duration": 3.0,
+    "max_duration": 10,
+    "confidence": 0.95,
+    "precision_pct": 5.0,
+    "bidir": False,
+    "parallel": 1,
+    "ntp_ttl": 300.0,
+    "trace": False,
+}
+
+SAMPLER_DEFAULTS = {
+    "rate_hz": 2.0,
+    "capacity": 7200,
+    "ping_every": 4,
+    "ping_timeout": 0.5,
+}
+
+RENDER_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "wifi_analyser",
+    "floors",
+)
+
+LIVE_HEATMAP_METRIC = "signal_dbm"
+
+LOG_CAPACITY = 5000
+LOG_STATUS_RATE_HZ = 10
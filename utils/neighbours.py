@@ -0,0 +1,185 @@
+import re, socket, struct, subprocess, threading, time
+
+from utils.linkstats import parseAttrs
+from utils.trace import run
+
+NETLINK_ROUTE = 0
+RTMGRP_NEIGH = 0x4
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+NDA_LLADDR = 2
+
+NUD_INCOMPLETE = 0x01
+NUD_FAILED = 0x20
+NUD_NOARP = 0x40
+ATF_COM = 0x2
+
+NLMSGHDR = struct.Struct("=IHHII")
+NDMSG = struct.Struct("=BBHiHBB")
+
+# Held by measure() for a whole measurement and by every sweep, so the
+# arp-scan traffic only ever goes out between measurements.
+sweepLock = threading.Lock()
+
+
+def getInetAndSubnet(iface):
+    inet = ""
+    subnet = 0
+    try:
+        out = subprocess.check_output(["ip", "addr", "show", iface]).decode()
+        regex = re.compile(r"inet\s+([0-9.]+)\/([0-9]+)", re.M)
+        match = regex.search(out)
+        if match is not None:
+            inet, subnet = match.groups()
+    except FileNotFoundError:
+        print("Command ip not found, cannot get wireless interfaces.")
+    finally:
+        return (inet, subnet)
+
+
+def readProcArp(iface):
+    macs = set()
+    try:
+        with open("/proc/net/arp", "r") as file:
+            lines = file.readlines()[1:]
+    except OSError:
+        return macs
+
+    for line in lines:
+        # IP address, HW type, Flags, HW address, Mask, Device
+        parts = line.split()
+        if len(parts) < 6 or parts[5] != iface:
+            continue
+        if not int(parts[2], 16) & ATF_COM:
+            continue
+        macs.add(parts[3].lower())
+
+    return macs
+
+
+def arpScan(inet, subnet):
+    network = re.sub(r"^((?:\d{1,3}\.){3})\d{1,3}$", r"\g<1>0", inet)
+    try:
+        res = run(
+            ["arp-scan", "-x", f"{network}/{subnet}"],
+            capture_output=True,
+            text=True,
+            timeout=15,
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return None
+    if res.returncode != 0:
+        return None
+
+    return {
+        parts[1].lower()
+        for parts in (line.split("\t") for line in res.stdout.splitlines())
+        if len(parts) >= 2
+    }
+
+
+# Keeps the set of devices seen on an interface up to date: a background
+# arp-scan sweep refreshes it periodically between measurements and
+# rtnetlink neighbour events (or /proc/net/arp when those are unavailable)
+# fill in between sweeps. The count is the number of devices seen in the
+# last retention seconds, a device that left the network keeps counting
+# until its entry ages out.
+class NeighbourTable:
+    def __init__(self, iface, sweep_interval=60.0, retention=300.0):
+        self.iface = iface
+        self.sweep_interval = sweep_interval
+        self.retention = retention
+        self.last_seen: dict[str, float] = {}
+        self.count = -1
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.threads: list[threading.Thread] = []
+
+    def start(self):
+        # The kernel's table answers until the first sweep gets its turn.
+        self._merge(readProcArp(self.iface))
+        for target in (self._sweepLoop, self._listen):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+
+    def _merge(self, macs, removed=()):
+        now = time.monotonic()
+        with self.lock:
+            for mac in macs:
+                self.last_seen[mac] = now
+            for mac in removed:
+                self.last_seen.pop(mac, None)
+            for mac, seen in list(self.last_seen.items()):
+                if now - seen > self.retention:
+                    del self.last_seen[mac]
+            self.count = len(self.last_seen)
+
+    def sweep(self):
+        inet, subnet = getInetAndSubnet(self.iface)
+        macs = arpScan(inet, subnet) if inet else None
+        if macs is None:
+            print("Failed to get devices via arp-scan, using the neighbour table...")
+
+        self._merge((macs or set()) | readProcArp(self.iface))
+        if macs is None and self.count == 0:
+            self.count = -1
+
+    def _sweepLoop(self):
+        while not self.stopped.is_set():
+            with sweepLock:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Neighbour sweep failed: {e}")
+            self.stopped.wait(self.sweep_interval)
+
+    def _listen(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_NEIGH))
+            ifindex = socket.if_nametoindex(self.iface)
+        except OSError:
+            while not self.stopped.wait(5):
+                self._merge(readProcArp(self.iface))
+            return
+
+        sock.settimeout(1)
+        with sock:
+            while not self.stopped.is_set():
+                try:
+                    data = sock.recv(65536)
+                except socket.timeout:
+                    continue
+
+                offset = 0
+                while offset + NLMSGHDR.size + NDMSG.size <= len(data):
+                    length, msg_type, _, _, _ = NLMSGHDR.unpack_from(data, offset)
+                    body = data[offset + NLMSGHDR.size : offset + length]
+                    offset += (length + 3) & ~3
+
+                    if msg_type not in (RTM_NEWNEIGH, RTM_DELNEIGH):
+                        continue
+                    _, _, _, index, state, _, _ = NDMSG.unpack_from(body)
+                    lladdr = parseAttrs(body[NDMSG.size :]).get(NDA_LLADDR)
+                    if index != ifindex or not lladdr:
+                        continue
+
+                    # Garbage-collected entries (RTM_DELNEIGH) simply age out,
+                    # only a failed resolution means the device is gone.
+                    mac = ":".join(f"{b:02x}" for b in lladdr)
+                    if state & NUD_FAILED:
+                        self._merge((), removed=(mac,))
+                    elif msg_type == RTM_NEWNEIGH and not state & (
+                        NUD_INCOMPLETE | NUD_NOARP
+                    ):
+                        self._merge((mac,))
+
+    def getCount(self):
+        # Never sweeps, only drops the entries that aged out since.
+        if self.count >= 0:
+            self._merge(())
+        return self.count
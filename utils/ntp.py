@@ -0,0 +1,90 @@
+from utils.trace import run
+
+import os, subprocess, threading, time
+
+
+def runBackend(cmd):
+    try:
+        res = run(cmd, capture_output=True, text=True, timeout=3)
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return ""
+    return res.stdout
+
+
+def timedatectlSynced():
+    out = runBackend(["timedatectl", "show", "-p", "NTPSynchronized", "--value"])
+    return out.strip().lower() == "yes"
+
+
+def chronycSynced():
+    out = runBackend(["chronyc", "tracking"])
+    return any(
+        "leap status" in line.lower() and "normal" in line.lower()
+        for line in out.splitlines()
+    )
+
+
+def ntpqSynced():
+    out = runBackend(["ntpq", "-p"])
+    return any(line.startswith("*") for line in out.splitlines())
+
+
+def adjtimeExists():
+    return os.path.exists("/etc/adjtime")
+
+
+BACKENDS = {
+    "timedatectl": timedatectlSynced,
+    "chronyc": chronycSynced,
+    "ntpq": ntpqSynced,
+    "adjtime": adjtimeExists,
+}
+
+
+class ClockSyncProbe:
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self.backend: str | None = None
+        self.synced: bool | None = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def probe(self) -> bool:
+        # Once a backend has reported a synced clock it is asked first, so a
+        # synced host costs one subprocess instead of walking the whole chain.
+        order = list(BACKENDS)
+        if self.backend is not None:
+            order.remove(self.backend)
+            order.insert(0, self.backend)
+
+        for name in order:
+            if BACKENDS[name]():
+                self.backend = name
+                return True
+
+        print("No way to check ntp status, assuming it isn't synced...")
+        return False
+
+    def refresh(self):
+        try:
+            synced = self.probe()
+            with self.lock:
+                self.synced = synced
+                self.checked_at = time.monotonic()
+        finally:
+            self.refreshing = False
+
+    def get(self) -> bool:
+        with self.lock:
+            synced = self.synced
+            stale = time.monotonic() - self.checked_at > self.ttl
+            if synced is not None and stale and not self.refreshing:
+                self.refreshing = True
+                threading.Thread(target=self.refresh, daemon=True).start()
+
+        if synced is None:
+            self.refresh()
+            synced = self.synced
+
+        return bool(synced)
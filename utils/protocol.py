@@ -0,0 +1,123 @@
+import json, struct
+
+# Every frame is a 4 byte big-endian length followed by a UTF-8 JSON object:
+#   request   {"type": "request", "id": n, "command": ..., "args": {...}}
+#   response  {"type": "response", "id": n, "command": ..., "data": {...}}
+#   error     {"type": "error", "id": n, "command": ..., "error": "..."}
+#   event     {"type": "event", "id": n, "event": ..., "data": {...}}
+# Responses and errors carry the id of the request they answer, events carry
+# the id of the request that started the job they belong to.
+
+CMD_START = "START_MEASUREMENT"
+CMD_START_BATCH = "START_BATCH"
+CMD_REORDER = "REORDER"
+CMD_CHANGE = "CHANGE"
+CMD_STATUS = "STATUS"
+CMD_CANCEL = "CANCEL"
+CMD_SAMPLER = "SAMPLER"
+CMD_SAMPLES = "SAMPLES"
+CMD_EXIT = "EXIT"
+
+TYPE_REQUEST = "request"
+TYPE_RESPONSE = "response"
+TYPE_ERROR = "error"
+TYPE_EVENT = "event"
+
+EVENT_PROGRESS = "progress"
+EVENT_FINISHED = "finished"
+EVENT_BATCH_FINISHED = "batch_finished"
+
+# Printed on its own line on the worker's stdout once the socket accepts
+# connections.
+READY_LINE = "READY"
+
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encodeFrame(message: dict) -> bytes:
+    body = json.dumps(message).encode("utf-8")
+    if len(body) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(body)} bytes exceeds the limit")
+    return HEADER.pack(len(body)) + body
+
+
+def decodeBody(body: bytes) -> dict:
+    message = json.loads(body.decode("utf-8"))
+    if not isinstance(message, dict) or "type" not in message:
+        raise ProtocolError("Frame is not a protocol message")
+    return message
+
+
+def makeRequest(request_id, command, args=None):
+    return {
+        "type": TYPE_REQUEST,
+        "id": request_id,
+        "command": command,
+        "args": args or {},
+    }
+
+
+def makeResponse(request_id, command, data=None):
+    return {
+        "type": TYPE_RESPONSE,
+        "id": request_id,
+        "command": command,
+        "data": data or {},
+    }
+
+
+def makeError(request_id, command, error, data=None):
+    message = {
+        "type": TYPE_ERROR,
+        "id": request_id,
+        "command": command,
+        "error": str(error),
+    }
+    # Failed or cancelled jobs carry their info and outcome.
+    if data is not None:
+        message["data"] = data
+    return message
+
+
+def makeEvent(request_id, event, data=None):
+    return {"type": TYPE_EVENT, "id": request_id, "event": event, "data": data or {}}
+
+
+class FrameDecoder:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[dict]:
+        self.buffer += data
+
+        messages = []
+        while len(self.buffer) >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer)
+            if length > MAX_FRAME_SIZE:
+                raise ProtocolError(f"Frame of {length} bytes exceeds the limit")
+            if len(self.buffer) < HEADER.size + length:
+                break
+
+            body = bytes(self.buffer[HEADER.size : HEADER.size + length])
+            del self.buffer[: HEADER.size + length]
+            messages.append(decodeBody(body))
+
+        return messages
+
+
+async def readFrame(reader):
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except EOFError:
+        return None
+
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds the limit")
+
+    return decodeBody(await reader.readexactly(length))
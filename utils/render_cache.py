@@ -0,0 +1,93 @@
+from utils.literals import RENDER_CACHE_DIR
+
+from collections import OrderedDict
+import hashlib, json, os, threading
+
+
+def makeKey(**parts) -> str:
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+# Rendered PNGs by key, the most recently used ones in memory and every one
+# of them in a directory so they survive restarts. Both sides are bounded,
+# the least recently used entry is evicted first.
+class RenderCache:
+    def __init__(
+        self,
+        max_entries: int = 16,
+        max_disk_entries: int = 128,
+        directory: str | None = RENDER_CACHE_DIR,
+    ):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.directory = directory
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _remember(self, key: str, data: bytes):
+        with self.lock:
+            self.entries[key] = data
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key: str) -> bytes | None:
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                return data
+
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._path(key), "rb") as file:
+                data = file.read()
+            # Touched so disk eviction also goes by last use.
+            os.utime(self._path(key))
+        except OSError:
+            return None
+
+        self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        self._remember(key, data)
+        if self.directory is None:
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, self._path(key))
+            self._prune()
+        except OSError as e:
+            print(f"Could not write render cache {self.directory}: {e}")
+
+    def _prune(self):
+        paths = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".png")
+        ]
+        if len(paths) <= self.max_disk_entries:
+            return
+
+        paths.sort(key=os.path.getmtime)
+        for path in paths[: len(paths) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
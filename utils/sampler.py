@@ -0,0 +1,269 @@
+from utils.icmp import ping
+from utils.linkstats import LinkStats
+from utils.literals import SAMPLER_DEFAULTS
+
+from array import array
+import math, threading, time
+
+NAN = float("nan")
+FLOAT_FIELDS = ("timestamp", "signal_dbm", "txrate_mbps", "rtt_ms")
+
+
+def toFloat(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def macToInt(mac):
+    try:
+        return int(mac.replace(":", ""), 16)
+    except (AttributeError, ValueError):
+        return 0
+
+
+def intToMac(value):
+    if not value:
+        return None
+    return ":".join(f"{b:02X}" for b in value.to_bytes(6, "big"))
+
+
+def percentile(values, q):
+    # values has to be sorted, linear interpolation between closest ranks.
+    if not values:
+        return None
+    rank = (len(values) - 1) * q
+    low = math.floor(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarise(values):
+    values = sorted(v for v in values if not math.isnan(v))
+    if not values:
+        return {
+            "count": 0,
+            "min": None,
+            "max": None,
+            "mean": None,
+            "p50": None,
+            "p95": None,
+        }
+    return {
+        "count": len(values),
+        "min": round(values[0], 3),
+        "max": round(values[-1], 3),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 0.5), 3),
+        "p95": round(percentile(values, 0.95), 3),
+    }
+
+
+def wallOffset():
+    return time.time() - time.monotonic()
+
+
+def toMonotonic(timestamp, offset):
+    return None if timestamp is None else timestamp - offset
+
+
+# Fixed size ring buffer, one preallocated array per column so a sample is a
+# handful of slot writes instead of a new dict. Missing values are NaN, a
+# BSSID is stored as its 48 bit integer with 0 meaning not associated.
+#
+# Timestamps are stored as time.monotonic(), so a clock step cannot reorder
+# the buffer. window() and aggregate() take and return wall clock times,
+# converted with the offset between the two clocks at query time.
+class SampleRing:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.columns = {name: array("d", [NAN]) * capacity for name in FLOAT_FIELDS}
+        self.bssid = array("Q", [0]) * capacity
+        self.probed = array("b", [0]) * capacity
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, signal_dbm, txrate_mbps, bssid, probed, rtt_ms):
+        with self.lock:
+            i = self.head
+            self.columns["timestamp"][i] = timestamp
+            self.columns["signal_dbm"][i] = signal_dbm
+            self.columns["txrate_mbps"][i] = txrate_mbps
+            self.columns["rtt_ms"][i] = rtt_ms
+            self.bssid[i] = bssid
+            self.probed[i] = probed
+            self.head = (i + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def indices(self, since=None, until=None):
+        # Oldest to newest on the monotonic clock, so the scan stops at the
+        # first sample past the window.
+        start = (self.head - self.count) % self.capacity
+        timestamps = self.columns["timestamp"]
+        selected = []
+        for n in range(self.count):
+            i = (start + n) % self.capacity
+            if since is not None and timestamps[i] < since:
+                continue
+            if until is not None and timestamps[i] > until:
+                break
+            selected.append(i)
+        return selected
+
+    def window(self, since=None, until=None):
+        offset = wallOffset()
+        with self.lock:
+            selected = self.indices(
+                toMonotonic(since, offset), toMonotonic(until, offset)
+            )
+            data = {
+                name: [None if math.isnan(column[i]) else column[i] for i in selected]
+                for name, column in self.columns.items()
+            }
+            data["timestamp"] = [t + offset for t in data["timestamp"]]
+            data["bssid"] = [intToMac(self.bssid[i]) for i in selected]
+            return data
+
+    def aggregate(self, since=None, until=None):
+        offset = wallOffset()
+        with self.lock:
+            selected = self.indices(
+                toMonotonic(since, offset), toMonotonic(until, offset)
+            )
+            timestamps = self.columns["timestamp"]
+            probes = [i for i in selected if self.probed[i]]
+            lost = sum(1 for i in probes if math.isnan(self.columns["rtt_ms"][i]))
+
+            bssids = [self.bssid[i] for i in selected if self.bssid[i]]
+            roams = sum(1 for a, b in zip(bssids, bssids[1:]) if a != b)
+
+            return {
+                "samples": len(selected),
+                "start": timestamps[selected[0]] + offset if selected else None,
+                "end": timestamps[selected[-1]] + offset if selected else None,
+                "signal_dbm": summarise(
+                    self.columns["signal_dbm"][i] for i in selected
+                ),
+                "txrate_mbps": summarise(
+                    self.columns["txrate_mbps"][i] for i in selected
+                ),
+                "rtt_ms": summarise(self.columns["rtt_ms"][i] for i in probes),
+                "ping_loss_pct": round(lost / len(probes) * 100, 2) if probes else None,
+                "bssids": sorted({intToMac(b) for b in bssids}),
+                "roams": roams,
+            }
+
+
+# Cheap continuous sampling between full measurements: every tick reads the
+# association from the kernel, every ping_every-th tick also sends a single
+# ICMP echo to the target.
+class Sampler:
+    def __init__(
+        self,
+        iface,
+        target,
+        rate_hz=SAMPLER_DEFAULTS["rate_hz"],
+        capacity=SAMPLER_DEFAULTS["capacity"],
+        ping_every=SAMPLER_DEFAULTS["ping_every"],
+        ping_timeout=SAMPLER_DEFAULTS["ping_timeout"],
+    ):
+        self.iface = iface
+        self.target = target
+        self.rate_hz = rate_hz
+        self.ping_every = ping_every
+        self.ping_timeout = ping_timeout
+        self.ring = SampleRing(capacity)
+        self.link_stats = LinkStats()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.paused = False
+        self.tick_lock = threading.Lock()
+
+    def running(self):
+        return (
+            self.thread is not None
+            and self.thread.is_alive()
+            and not self.stop_event.is_set()
+        )
+
+    def start(self):
+        if self.running():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Not joined, a tick that is waiting on a probe finishes on its own.
+        self.stop_event.set()
+
+    def pause(self):
+        # Full measurements run their ping and iperf3 stages exclusively, no
+        # sample is taken until resume(). Waits out a tick already running.
+        self.paused = True
+        with self.tick_lock:
+            pass
+
+    def resume(self):
+        self.paused = False
+
+    def probe(self):
+        try:
+            result = ping(self.target, count=1, timeout=self.ping_timeout)
+        except OSError:
+            return (0, NAN)
+        rtt = result["samples"][0][2]
+        return (1, NAN if rtt is None else rtt)
+
+    def sample(self, tick):
+        link = None
+        try:
+            link = self.link_stats.read(self.iface)
+        except OSError:
+            pass
+        link = link or {}
+
+        probed, rtt = (0, NAN)
+        if self.ping_every and self.target and tick % self.ping_every == 0:
+            probed, rtt = self.probe()
+
+        self.ring.append(
+            time.monotonic(),
+            toFloat(link.get("signal_dbm")),
+            toFloat(link.get("txrate")),
+            macToInt(link.get("bssid")),
+            probed,
+            rtt,
+        )
+
+    def _run(self):
+        period = 1 / self.rate_hz
+        next_tick = time.monotonic()
+        tick = 0
+        while not self.stop_event.is_set():
+            with self.tick_lock:
+                if not self.paused:
+                    self.sample(tick)
+                    tick += 1
+
+            # Ticks are scheduled on a fixed grid, a slow probe delays the next
+            # sample instead of shifting every following one.
+            next_tick += period
+            now = time.monotonic()
+            if next_tick < now:
+                next_tick = now
+            self.stop_event.wait(next_tick - now)
+
+    def status(self):
+        return {
+            "running": self.running(),
+            "iface": self.iface,
+            "target": self.target,
+            "rate_hz": self.rate_hz,
+            "ping_every": self.ping_every,
+            "capacity": self.ring.capacity,
+            "stored": self.ring.count,
+            "paused": self.paused,
+        }
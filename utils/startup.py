@@ -0,0 +1,36 @@
+import sys, time
+
+# Heavy modules, listed per checkpoint once they have been imported.
+DEFERRED_MODULES = ("cairosvg", "matplotlib", "numpy", "PIL", "sqlite3")
+
+
+# Wall clock checkpoints from process start to the first painted window,
+# printed by `gui.py --startup-report`. For a per-module breakdown of the
+# import phase run `python -X importtime gui.py --startup-report`.
+class StartupReport:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks: list[tuple[str, float, int, tuple[str, ...]]] = []
+        self.enabled = "--startup-report" in sys.argv
+
+    def mark(self, name: str):
+        loaded = tuple(m for m in DEFERRED_MODULES if m in sys.modules)
+        self.marks.append(
+            (name, time.perf_counter() - self.start, len(sys.modules), loaded)
+        )
+
+    def report(self, file=None):
+        file = file or sys.__stdout__
+        print("Startup report:", file=file)
+
+        previous = 0.0
+        for name, at, modules, loaded in self.marks:
+            print(
+                f"  {name:<24} {at * 1000:8.1f} ms  (+{(at - previous) * 1000:7.1f} ms)"
+                f"  {modules:5d} modules  {', '.join(loaded) or '-'}",
+                file=file,
+            )
+            previous = at
+
+
+startup = StartupReport()
@@ -0,0 +1,227 @@
+from utils.literals import MEASURE_HEADERS, MEASURE_TYPES
+
+import csv, io, os, time
+
+POSITION_COLUMNS = ("position_x", "position_y", "position_in_room")
+SQL_TYPES = {str: "TEXT", int: "INTEGER", float: "REAL"}
+
+
+def convert(value, type_):
+    if value is None or value == "":
+        return None
+    try:
+        if type_ is int:
+            return int(float(value))
+        return type_(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def typedRow(row):
+    return {
+        key: convert(row.get(key), MEASURE_TYPES.get(key, str)) for key in MEASURE_HEADERS
+    }
+
+
+def readCsvSince(path, offset=0):
+    # Only complete lines are parsed, a row that is still being written is
+    # picked up by the next call starting from the returned offset.
+    with open(path, "rb") as file:
+        header = file.readline()
+        file.seek(max(offset, len(header)))
+        chunk = file.read()
+
+    end = chunk.rfind(b"\n") + 1
+    fieldnames = next(csv.reader([header.decode("utf-8")]), [])
+    reader = csv.DictReader(
+        io.StringIO(chunk[:end].decode("utf-8"), newline=""), fieldnames=fieldnames
+    )
+    return (list(reader), max(offset, len(header)) + end)
+
+
+class CsvStorage:
+    def __init__(self, path, overwrite=False, readonly=False):
+        self.path = path
+        self.file = None
+        if readonly:
+            return
+
+        first_write = (
+            overwrite or not os.path.exists(path) or os.path.getsize(path) == 0
+        )
+
+        # Files created before a header was added keep their original columns,
+        # appending rows in the new layout would shift every later column.
+        fieldnames = MEASURE_HEADERS
+        if not first_write:
+            with open(path, "r", newline="") as file:
+                fieldnames = next(csv.reader(file), None) or MEASURE_HEADERS
+
+        self.file = open(path, "w" if overwrite else "a", newline="")
+        self.writer = csv.DictWriter(
+            self.file, fieldnames=fieldnames, extrasaction="ignore"
+        )
+        if first_write:
+            self.writer.writeheader()
+            self.file.flush()
+
+    def append(self, row):
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+    def rows(self):
+        self.flush()
+        with open(self.path, "r", newline="") as file:
+            for row in csv.DictReader(file):
+                yield typedRow(row)
+
+    def readSince(self, cursor=0):
+        self.flush()
+        rows, cursor = readCsvSince(self.path, cursor)
+        return ([typedRow(row) for row in rows], cursor)
+
+    def positions(self):
+        seen = set()
+        for row in self.rows():
+            position = tuple(row[key] for key in POSITION_COLUMNS)
+            if None not in position and position not in seen:
+                seen.add(position)
+                yield position
+
+    def files(self):
+        return [self.path]
+
+
+class SqliteStorage:
+    def __init__(
+        self,
+        path,
+        overwrite=False,
+        readonly=False,
+        batch_size=50,
+        commit_interval=5.0,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+        # Only loaded when a floor is kept in SQLite, not at GUI startup.
+        import sqlite3
+
+        if readonly:
+            self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            return
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+        columns = ", ".join(
+            f"{key} {SQL_TYPES[MEASURE_TYPES.get(key, str)]}" for key in MEASURE_HEADERS
+        )
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS measurements ({columns})")
+        existing = {row[1] for row in self.db.execute("PRAGMA table_info(measurements)")}
+        for key in MEASURE_HEADERS:
+            if key not in existing:
+                self.db.execute(
+                    f"ALTER TABLE measurements ADD COLUMN {key} "
+                    f"{SQL_TYPES[MEASURE_TYPES.get(key, str)]}"
+                )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS measurements_position "
+            f"ON measurements ({', '.join(POSITION_COLUMNS)})"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS measurements_timestamp "
+            "ON measurements (timestamp)"
+        )
+        if overwrite:
+            self.db.execute("DELETE FROM measurements")
+        self.db.commit()
+
+        self.insert = (
+            f"INSERT INTO measurements ({', '.join(MEASURE_HEADERS)}) "
+            f"VALUES ({', '.join('?' for _ in MEASURE_HEADERS)})"
+        )
+
+    def append(self, row):
+        typed = typedRow(row)
+        self.db.execute(self.insert, [typed[key] for key in MEASURE_HEADERS])
+        self.pending += 1
+
+        if (
+            self.pending >= self.batch_size
+            or time.monotonic() - self.last_commit >= self.commit_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.db.commit()
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def rows(self):
+        self.flush()
+        cursor = self.db.execute(
+            f"SELECT {', '.join(MEASURE_HEADERS)} FROM measurements ORDER BY rowid"
+        )
+        for values in cursor:
+            yield dict(zip(MEASURE_HEADERS, values))
+
+    def readSince(self, cursor=0):
+        self.flush()
+        rows = self.db.execute(
+            f"SELECT rowid, {', '.join(MEASURE_HEADERS)} FROM measurements "
+            "WHERE rowid > ? ORDER BY rowid",
+            (cursor,),
+        ).fetchall()
+        if rows:
+            cursor = rows[-1][0]
+        return ([dict(zip(MEASURE_HEADERS, values[1:])) for values in rows], cursor)
+
+    def positions(self):
+        self.flush()
+        where = " AND ".join(f"{key} IS NOT NULL" for key in POSITION_COLUMNS)
+        yield from self.db.execute(
+            f"SELECT DISTINCT {', '.join(POSITION_COLUMNS)} FROM measurements "
+            f"WHERE {where}"
+        )
+
+    def files(self):
+        return [self.path, f"{self.path}-wal", f"{self.path}-shm"]
+
+
+def openStorage(path, overwrite=False, readonly=False):
+    if os.path.splitext(path)[1].lower() in (".db", ".sqlite", ".sqlite3"):
+        return SqliteStorage(path, overwrite=overwrite, readonly=readonly)
+    return CsvStorage(path, overwrite=overwrite, readonly=readonly)
+
+
+def exportParquet(storage, out):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    arrow_types = {str: pa.string(), int: pa.int64(), float: pa.float64()}
+    schema = pa.schema(
+        [(key, arrow_types[MEASURE_TYPES.get(key, str)]) for key in MEASURE_HEADERS]
+    )
+    table = pa.Table.from_pylist(list(storage.rows()), schema=schema)
+    pq.write_table(table, out)
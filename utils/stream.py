@@ -1,11 +1,39 @@
-import sys
-from PySide6.QtCore import QObject, Signal
+import itertools, threading, time
+from collections import deque
 
-class Stream(QObject):
-    textWritten = Signal(str)
+
+# Replaces sys.stdout in the GUI. Writes only append to a bounded ring of
+# (timestamp, line) records under a lock, readers poll it on a timer, so a
+# burst of prints from any thread costs no signals or repaints.
+class LogSink:
+    def __init__(self, capacity: int = 5000):
+        self.lines: deque[tuple[float, str]] = deque(maxlen=capacity)
+        self.sequence = 0  # Lines written so far, including dropped ones.
+        self.pending = ""
+        self.lock = threading.Lock()
 
     def write(self, text):
-        self.textWritten.emit(str(text))
+        text = str(text)
+        with self.lock:
+            *complete, self.pending = (self.pending + text).split("\n")
+            now = time.time()
+            for line in complete:
+                if line.strip():
+                    self.lines.append((now, line.rstrip()))
+                    self.sequence += 1
+        return len(text)
 
     def flush(self):
-        pass
\ No newline at end of file
+        pass
+
+    def last(self) -> tuple[float, str] | None:
+        with self.lock:
+            return self.lines[-1] if self.lines else None
+
+    def since(self, sequence: int) -> tuple[int, list[tuple[float, str]]]:
+        # Lines written after sequence, and the sequence to ask with next.
+        # Lines that already fell out of the ring are skipped.
+        with self.lock:
+            count = min(self.sequence - sequence, len(self.lines))
+            lines = list(itertools.islice(reversed(self.lines), count))
+            return (self.sequence, lines[::-1])
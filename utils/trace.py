@@ -0,0 +1,168 @@
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from utils.sampler import percentile
+
+import json, os, subprocess, threading, time
+
+
+# Monotonic spans recorded during one measure() call. Every span keeps its
+# thread, so the concurrent stages show up as parallel lanes in a trace
+# viewer, and an args dict callers can add to while the span is open.
+class Tracer:
+    def __init__(self):
+        self.origin_ns = time.perf_counter_ns()
+        self.wall_ns = time.time_ns()
+        self.spans: list[tuple[str, int, int, int, dict]] = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **args):
+        start = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter_ns()
+            with self.lock:
+                self.spans.append((name, start, end, threading.get_native_id(), args))
+
+    def chromeEvents(self) -> list[dict]:
+        # Complete ("X") events in microseconds since the epoch, so traces of
+        # several measurements line up on one timeline.
+        pid = os.getpid()
+        return [
+            {
+                "name": name,
+                "cat": "measure",
+                "ph": "X",
+                "ts": (self.wall_ns + start - self.origin_ns) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            }
+            for name, start, end, tid, args in self.spans
+        ]
+
+
+# The tracer lives in a context variable so the subprocess helpers find it
+# without threading it through every call. Only the thread running measure()
+# and the stage threads started with bound() see it, background threads such
+# as the neighbour sweep or the NTP refresh are never recorded.
+current: ContextVar[Tracer | None] = ContextVar("tracer", default=None)
+
+
+@contextmanager
+def tracing(enabled: bool = True):
+    tracer = Tracer() if enabled else None
+    token = current.set(tracer)
+    try:
+        yield tracer
+    finally:
+        current.reset(token)
+
+
+def bound(fn):
+    # fn running in the caller's context, for handing work to another thread.
+    context = copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+@contextmanager
+def span(name: str, **args):
+    active = current.get()
+    if active is None:
+        yield args
+        return
+
+    with active.span(name, **args) as args:
+        yield args
+
+
+def run(cmd, timeout: float | None = None, **kwargs):
+    # subprocess.run that also records how long the spawn itself took and
+    # how much output there was to parse.
+    if current.get() is None:
+        return subprocess.run(cmd, timeout=timeout, **kwargs)
+
+    if kwargs.pop("capture_output", False):
+        kwargs["stdout"] = kwargs["stderr"] = subprocess.PIPE
+    program = cmd.split()[0] if isinstance(cmd, str) else cmd[0]
+
+    with span(f"exec {os.path.basename(program)}") as info:
+        start = time.perf_counter_ns()
+        with subprocess.Popen(cmd, **kwargs) as proc:
+            # Popen returns once the child has exec'd.
+            info["spawn_ms"] = (time.perf_counter_ns() - start) / 1e6
+            try:
+                stdout, stderr = proc.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.communicate()
+                raise
+
+        info["returncode"] = proc.returncode
+        info["stdout_bytes"] = outputSize(stdout)
+        return subprocess.CompletedProcess(proc.args, proc.returncode, stdout, stderr)
+
+
+def outputSize(output) -> int:
+    if output is None:
+        return 0
+    return len(output.encode() if isinstance(output, str) else output)
+
+
+def tracePath(out: str) -> str:
+    return os.path.splitext(out)[0] + ".trace.json"
+
+
+def appendTrace(path: str, tracer: Tracer):
+    # JSON array format without the closing bracket, which trace viewers
+    # accept, so every measurement is a plain append.
+    with open(path, "a", encoding="utf-8") as file:
+        if file.tell() == 0:
+            file.write("[\n")
+        for event in tracer.chromeEvents():
+            file.write(json.dumps(event) + ",\n")
+
+
+def readTrace(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as file:
+        text = file.read().strip().rstrip(",")
+    if not text:
+        return []
+    if not text.endswith("]"):
+        text += "]"
+    return json.loads(text)
+
+
+def summariseTrace(events: list[dict]) -> dict[str, dict]:
+    # Latency percentiles per span name in milliseconds, plus spawn overhead
+    # and output size for the subprocess spans.
+    grouped: dict[str, dict[str, list[float]]] = {}
+    for event in events:
+        if event.get("ph") != "X":
+            continue
+        values = grouped.setdefault(
+            event["name"], {"dur": [], "spawn": [], "bytes": []}
+        )
+        values["dur"].append(event["dur"] / 1000)
+        args = event.get("args", {})
+        if "spawn_ms" in args:
+            values["spawn"].append(args["spawn_ms"])
+        if "stdout_bytes" in args:
+            values["bytes"].append(args["stdout_bytes"])
+
+    summary = {}
+    for name, values in grouped.items():
+        durations = sorted(values["dur"])
+        spawn = sorted(values["spawn"])
+        summary[name] = {
+            "count": len(durations),
+            "p50_ms": percentile(durations, 0.5),
+            "p95_ms": percentile(durations, 0.95),
+            "spawn_p50_ms": percentile(spawn, 0.5),
+            "spawn_p95_ms": percentile(spawn, 0.95),
+            "bytes": sum(values["bytes"]) if values["bytes"] else None,
+        }
+
+    return summary
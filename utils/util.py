@@ -1,12 +1,13 @@
-from pathlib import Path
-from cairosvg import svg2png
 from PySide6.QtWidgets import QMainWindow
 from PySide6.QtCore import QPoint, Qt
 from PySide6.QtGui import QPainter, QPixmap, QColor, QPalette
 from shutil import which
 
 from widgets.ap import AP
-from utils.literals import APS_FILE, APS_HEADERS
+from utils.literals import APS_FILE, APS_HEADERS, MEASURE_FILE_SUFFIX
+from utils.floor_index import getFloorIndex
+from utils.render_cache import RenderCache, makeKey
+from utils.floor_template import loadTemplate
 
 import io, sys, os, csv, re, subprocess
 
@@ -21,23 +22,40 @@ def getDependencies():
     }
 
 
+backgroundCache = RenderCache()
+
+
 def makeBackgroundImage(
     replace_map: dict[str, str] = {},
     template_path: str = "media/floor_template.svg",
+    output_width: int | None = None,
+    output_height: int | None = None,
 ):
-    template = Path(getResourcePath(template_path)).read_text()
-
-    for key, value in replace_map.items():
-        template = template.replace(f"{{{key}}}", value)
-
-    template = template.replace("Erdős Pál Kollégium", "")
-    template = template.replace("{floor}", "")
-
-    image = io.BytesIO()
-    svg2png(bytestring=template.encode("utf-8"), write_to=image)
-    image.seek(0)
-
-    return image
+    # The GUI draws its own title, the template's is left out.
+    template = loadTemplate(
+        getResourcePath(template_path), remove=("Erdős Pál Kollégium",)
+    )
+    key = makeKey(
+        kind="background",
+        template=template.digest,
+        replace_map=replace_map,
+        size=[output_width, output_height],
+    )
+
+    data = backgroundCache.get(key)
+    if data is None:
+        # cairosvg (and cairo behind it) is only loaded on a cache miss.
+        from cairosvg import svg2png
+
+        svg = template.render(replace_map, defaults={"floor": ""})
+        data = svg2png(
+            bytestring=svg.encode("utf-8"),
+            output_width=output_width,
+            output_height=output_height,
+        )
+        backgroundCache.put(key, data)
+
+    return io.BytesIO(data)
 
 
 def makeRepmap(building: str = "A", floor: int = 1):
@@ -98,44 +116,31 @@ def saveAPLocation(location: str = "A1", x: int = 0, y: int = 0):
     file.close()
 
 
-def load(window: QMainWindow, location: str = "A1") -> tuple[list[str], list[AP]]:
-    done_zones: list[str] = []
+def load(
+    window: QMainWindow, location: str = "A1", suffix: str = MEASURE_FILE_SUFFIX
+) -> tuple[set[str], list[AP], list[tuple[int, int, int, float]]]:
+    done_zones: set[str] = set()
     aps: list[AP] = []
 
-    floor_measure = f"{location.lower()}_measure.csv"
-
-    if os.path.exists(APS_FILE):
-        file = open(APS_FILE, "r")
-        reader = csv.DictReader(file, fieldnames=APS_HEADERS)
-        for row in reader:
-            if row["floor"] == location:
-                aps.append(
-                    AP(
-                        window,
-                        QPoint(int(row["x"]), int(row["y"])),
-                    )
-                )
-        file.close()
-
-    if os.path.exists(floor_measure):
-        file = open(floor_measure, "r")
-        reader = csv.DictReader(file)
-        for row in reader:
-            x: int = int(row["position_x"])
-            y: int = int(row["position_y"])
-            pir: int = int(row["position_in_room"])
+    index = getFloorIndex(location, suffix=suffix)
 
-            f_or_s = "f" if x <= 4 else "s"
-            l_or_r = "l" if y == 0 else "r"
+    for x, y in index.apPoints():
+        aps.append(
+            AP(
+                window,
+                QPoint(x, y),
+            )
+        )
 
-            name: str = f"{f_or_s}{l_or_r}{x - 0 if f_or_s == "f" else 4}{pir}"
+    for x, y, pir in index.positions:
+        f_or_s = "f" if x <= 4 else "s"
+        l_or_r = "l" if y == 0 else "r"
 
-            if name not in done_zones:
-                done_zones.append(name)
+        name: str = f"{f_or_s}{l_or_r}{x - 0 if f_or_s == "f" else 4}{pir}"
 
-        file.close()
+        done_zones.add(name)
 
-    return (done_zones, aps)
+    return (done_zones, aps, index.measurementValues())
 
 
 def getResourcePath(relative_path):
@@ -1,38 +1,131 @@
 from shutil import which
-from PySide6.QtCore import QObject, Signal, Slot, QThread
+from PySide6.QtCore import QObject, Signal, Slot, QThread, QTimer
 from utils.util import getResourcePath
-from utils.literals import SOCKET_PATH
+from utils.literals import SOCKET_PATH, WORKER_READY_TIMEOUT, WORKER_STATUS_TIMEOUT
+from utils.protocol import (
+    CMD_EXIT,
+    CMD_STATUS,
+    TYPE_RESPONSE,
+    TYPE_ERROR,
+    TYPE_EVENT,
+    EVENT_PROGRESS,
+    EVENT_FINISHED,
+    EVENT_BATCH_FINISHED,
+    READY_LINE,
+    FrameDecoder,
+    ProtocolError,
+    encodeFrame,
+    makeRequest,
+)
 
-import subprocess, socket, time, json
+import subprocess, socket, sys, os, itertools, threading
 
 
 class Worker(QObject):
-    def __init__(self):
+    def __init__(self, start=True, persistent=False):
         super().__init__()
+        self.persistent = persistent
         self.process = None
         self.sock = None
         self.signals = WorkerSignals()
+        self.request_ids = itertools.count(1)
+        self.send_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.cancelled = False
+        # A non-persistent worker whose window went away without EXIT.
+        self.adopted = False
 
         self.comm_thread = QThread()
         self.moveToThread(self.comm_thread)
 
         self.comm_thread.started.connect(self._run_connection_loop)
 
-        self.start_worker_server()
-        self.comm_thread.start()
+        if start:
+            # A persistent worker left by an earlier session is reused as is,
+            # launching a second one would take its socket over.
+            if not self._connect_existing():
+                self.start_worker_server()
+            self.comm_thread.start()
+
+    def _connect_existing(self):
+        # True when a worker is already listening, whether it could be
+        # reused or not.
+        if not os.path.exists(SOCKET_PATH):
+            return False
+
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(SOCKET_PATH)
+            status = self._request_status()
+        except (OSError, ValueError, ProtocolError):
+            # Left behind by a worker that did not exit cleanly.
+            self.sock.close()
+            self.sock = None
+            return False
+
+        if not status.get("persistent") and status.get("clients", 0) > 1:
+            # Owned by another window, which tells it to exit when it closes.
+            self.sock.close()
+            self.sock = None
+            # Emitted once the caller had a chance to connect to the signal.
+            QTimer.singleShot(
+                0,
+                lambda: self.signals.connection_error.emit(
+                    "Another window's worker is running, close that window first."
+                ),
+            )
+            self.cancelled = True
+            self.ready.set()
+            return True
+
+        if not status.get("persistent"):
+            # Only our own connection, the window that launched it is gone
+            # and it would otherwise run until the next reboot. Taken over
+            # and told to exit like one we launched.
+            print("Adopting worker of a closed window.")
+            self.adopted = True
+        else:
+            print("Reusing running worker.")
+        self.ready.set()
+        return True
+
+    def _request_status(self):
+        request_id = next(self.request_ids)
+        self.sock.settimeout(WORKER_STATUS_TIMEOUT)
+        self.sock.sendall(encodeFrame(makeRequest(request_id, CMD_STATUS)))
+
+        decoder = FrameDecoder()
+        while True:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionResetError("Worker closed the connection")
+            for message in decoder.feed(data):
+                if message.get("id") == request_id:
+                    self.sock.settimeout(None)
+                    return message.get("data") or {}
 
     @Slot()
     def start_worker_server(self):
         try:
             pkexec_available = which("pkexec") is not None
+            command = [
+                "pkexec" if pkexec_available else "sudo",
+                "/usr/bin/env",
+                "python3",
+                getResourcePath("analyser_server.py"),
+            ]
+            if self.persistent:
+                command.append("--persistent")
+
             self.process = subprocess.Popen(
-                [
-                    "pkexec" if pkexec_available else "sudo",
-                    "/usr/bin/env",
-                    "python3",
-                    getResourcePath("analyser_server.py"),
-                ]
+                command,
+                stdout=subprocess.PIPE,
+                text=True,
+                bufsize=1,
+                # Keeps a persistent worker out of the terminal's Ctrl+C.
+                start_new_session=self.persistent,
             )
+            threading.Thread(target=self._read_output, daemon=True).start()
             print(self.process)
             return True
         except Exception as e:
@@ -40,10 +133,31 @@ class Worker(QObject):
             self.signals.connection_error.emit(f"Failed to start worker: {e}")
             return False
 
+    def _read_output(self):
+        # The worker's output is passed through to the terminal, the ready
+        # line tells us the socket is listening.
+        for line in self.process.stdout:
+            if line.strip() == READY_LINE:
+                self.ready.set()
+            else:
+                sys.__stdout__.write(line)
+                sys.__stdout__.flush()
+
+        # Wakes up the connection loop if the worker exits before it is ready.
+        self.process.wait()
+        self.ready.set()
+
     @Slot()
     def _run_connection_loop(self):
-        retries = 10
-        for i in range(retries):
+        print("Waiting for worker...")
+        if not self.ready.wait(WORKER_READY_TIMEOUT):
+            print("Error: Worker did not become ready.")
+            self.signals.connection_error.emit("Connection failed: Worker timed out.")
+            return
+        if self.cancelled:
+            return
+
+        if self.sock is None:
             if self.process is None or self.process.poll() is not None:
                 self.signals.connection_error.emit(
                     "Worker process terminated prematurely."
@@ -53,34 +167,31 @@ class Worker(QObject):
             try:
                 self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
                 self.sock.connect(SOCKET_PATH)
-                print("Successfully connected to worker socket.")
-                self.signals.connected.emit()
-                break
-            except (ConnectionRefusedError, FileNotFoundError):
-                print(f"Waiting for worker socket... (attempt {i+1})")
-                time.sleep(2)
-        else:
-            print("Error: Could not connect to worker socket.")
-            self.signals.connection_error.emit(
-                "Connection failed: Max retries reached."
-            )
-            return
+            except OSError as e:
+                print(f"Error: Could not connect to worker socket: {e}")
+                self.signals.connection_error.emit(f"Connection failed: {e}")
+                self.sock = None
+                return
+
+            if self.cancelled:
+                # stop() ran while we were connecting and did not see the socket.
+                self.sock.close()
+                self.sock = None
+                return
+
+        print("Successfully connected to worker socket.")
+        self.signals.connected.emit()
 
         try:
+            decoder = FrameDecoder()
             while True:
-                data = self.sock.recv(1024)
+                data = self.sock.recv(65536)
                 if not data:
                     print("Worker disconnected")
                     break
 
-                response = data.decode("utf-8")
-                if response == "MEASUREMENT_FINISHED":
-                    self.signals.finished.emit()
-                elif response.startswith("COMMAND_ERROR"):
-                    error_json = json.loads(response.removeprefix("COMMAND_ERROR "))
-                    self.signals.command_error.emit(error_json)
-                else:
-                    self.signals.response_received.emit(response)
+                for message in decoder.feed(data):
+                    self._handle_message(message)
 
         except ConnectionResetError:
             print("Connection reset by worker.")
@@ -92,35 +203,91 @@ class Worker(QObject):
             self.signals.disconnected.emit()
             print("Socket listener thread finished.")
 
-    @Slot(str)
-    def send_command(self, command):
-        if self.sock:
-            try:
-                self.sock.sendall(command.encode("utf-8"))
-            except Exception as e:
-                print(f"Error sending command: {e}")
-                self.sock.close()
-                self.sock = None
-        else:
+    def _handle_message(self, message):
+        if message["type"] == TYPE_EVENT:
+            if message["event"] == EVENT_FINISHED:
+                # Jobs of a START_BATCH report separately from single ones.
+                if "batch" in message["data"]:
+                    self.signals.batch_job_finished.emit(message["data"])
+                else:
+                    self.signals.finished.emit(message["data"])
+            elif message["event"] == EVENT_BATCH_FINISHED:
+                self.signals.batch_finished.emit(message["data"])
+            elif message["event"] == EVENT_PROGRESS:
+                self.signals.progress.emit(message["data"])
+            self.signals.event_received.emit(message)
+        elif message["type"] == TYPE_ERROR:
+            self.signals.command_error.emit(message)
+        elif message["type"] == TYPE_RESPONSE:
+            self.signals.response_received.emit(message)
+
+    def send_command(self, command, args=None):
+        if not self.sock:
             print("Error: Not connected, cannot send command.")
+            return None
+
+        request_id = next(self.request_ids)
+        try:
+            with self.send_lock:
+                self.sock.sendall(encodeFrame(makeRequest(request_id, command, args)))
+        except Exception as e:
+            print(f"Error sending command: {e}")
+            self.sock.close()
+            self.sock = None
+            return None
+
+        return request_id
 
     @Slot()
     def stop(self):
-        if self.sock:
-            self.send_command("EXIT")
+        # Only a worker this session launched for itself or adopted is told
+        # to exit, a persistent one stays up for the next session.
+        owned = (self.process is not None or self.adopted) and not self.persistent
+
+        # Wakes the connection loop if it is still waiting for READY.
+        self.cancelled = True
+        self.ready.set()
+
+        connected = self.sock is not None
+        if connected:
+            if owned:
+                self.send_command(CMD_EXIT)
+            else:
+                self.sock.shutdown(socket.SHUT_RDWR)
 
         self.comm_thread.quit()
         self.comm_thread.wait()
 
-        if self.process:
+        if self.process is not None and not connected:
+            # Closed during the password prompt or before the worker was
+            # ready, nobody is going to tell it to exit.
+            self._terminate_process()
+        elif owned and self.process is not None:
             self.process.wait()
-        print("Worker stopped.")
+        print("Worker stopped." if owned else "Detached from worker.")
+
+    def _terminate_process(self):
+        try:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait(timeout=2)
+        except (PermissionError, ProcessLookupError, subprocess.TimeoutExpired):
+            # Once pkexec has exec'd the worker it runs as root and is out of
+            # our reach, it is left to exit on its own.
+            pass
 
 
 class WorkerSignals(QObject):
     connected = Signal()
     disconnected = Signal()
-    finished = Signal()
+    finished = Signal(dict)
+    batch_job_finished = Signal(dict)
+    batch_finished = Signal(dict)
+    progress = Signal(dict)
     command_error = Signal(dict)
-    response_received = Signal(str)
+    response_received = Signal(dict)
+    event_received = Signal(dict)
     connection_error = Signal(str)
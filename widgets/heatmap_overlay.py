@@ -0,0 +1,140 @@
+from PySide6.QtCore import Qt, QRect
+from PySide6.QtGui import QPainter, QImage
+from PySide6.QtWidgets import QWidget
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+# Shades every measured room from its thirds, or with method "idw"/"rbf"
+# fills the whole floor from all measurements like render_cli --method does.
+class HeatmapOverlay(QWidget):
+    def __init__(self, parent=None, metric="signal_dbm", alpha=0.5, method="rooms"):
+        super().__init__(parent)
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+
+        self._metric = metric
+        self._alpha = alpha
+        self._method = method
+        self._lut = None
+        self._bboxes: dict[tuple[int, int], tuple[int, int, int, int]] = {}
+        self._priors: list[tuple[int, int]] = []
+        self._rooms: dict[tuple[int, int], "np.ndarray"] = {}
+        self._pixels = None
+        self._image = QImage()
+
+    def setRooms(self, bboxes):
+        # bboxes are (left, top, right, bottom) in this widget's coordinates.
+        self._bboxes = dict(bboxes)
+        # Made again with the next values, numpy is not needed before then.
+        self._pixels = None
+        self._image = QImage()
+        self.clear()
+
+    def _allocate(self):
+        import numpy as np
+
+        self._pixels = np.zeros((self.height(), self.width(), 4), dtype=np.uint8)
+        # The image shares the array, painting a room only touches its pixels.
+        self._image = QImage(
+            self._pixels.data,
+            self.width(),
+            self.height(),
+            self.width() * 4,
+            QImage.Format.Format_RGBA8888,
+        )
+
+    def _paint(self, rooms):
+        # utils.heatmap pulls in matplotlib for the colormap and numpy, they
+        # are loaded with the first values instead of at startup.
+        import numpy as np
+        from utils.heatmap import (
+            HEATMAP_METRICS,
+            makeColorLut,
+            metricColormap,
+            paintRooms,
+            renderGridOverlay,
+        )
+
+        if self._pixels is None:
+            self._allocate()
+        if self._lut is None:
+            _, _, self._vmin, self._vmax, invert = HEATMAP_METRICS[self._metric]
+            self._lut = makeColorLut(metricColormap(invert), self._alpha)
+
+        if self._method == "rooms":
+            paintRooms(
+                self._pixels, rooms, self._bboxes, self._vmin, self._vmax, self._lut
+            )
+            return
+
+        # Every value moves the whole interpolated floor, so it is redrawn
+        # from all rooms whatever was passed.
+        self._pixels[:] = renderGridOverlay(
+            (self.width(), self.height()),
+            [
+                (x, y, pir + 1, value)
+                for (x, y), thirds in self._rooms.items()
+                for pir, value in enumerate(thirds)
+                if not np.isnan(value)
+            ],
+            self._bboxes,
+            self._vmin,
+            self._vmax,
+            self._lut,
+            method=self._method,
+            priors=self._priors,
+        )
+
+    def setPriors(self, points):
+        # AP positions in this widget's coordinates, an interpolated floor
+        # bends towards them between sparse measurements.
+        self._priors = list(points)
+        if self._method != "rooms" and self._rooms:
+            self._paint(self._rooms)
+            self.update()
+
+    def clear(self):
+        self._rooms.clear()
+        if self._pixels is not None:
+            self._pixels[:] = 0
+        self.update()
+
+    def setValues(self, data):
+        self.clear()
+        for x, y, pir, value in data:
+            self._store(x, y, pir, value)
+
+        if self._rooms:
+            self._paint(self._rooms)
+        self.update()
+
+    def setValue(self, x, y, pir, value):
+        key = self._store(x, y, pir, value)
+        if key is None:
+            return
+
+        self._paint({key: self._rooms[key]})
+        if self._method != "rooms":
+            self.update()
+            return
+
+        left, top, right, bottom = self._bboxes[key]
+        self.update(QRect(left, top, right - left, bottom - top))
+
+    def _store(self, x, y, pir, value):
+        if value is None or (x, y) not in self._bboxes or pir not in (1, 2, 3):
+            return None
+
+        import numpy as np
+
+        self._rooms.setdefault((x, y), np.full(3, np.nan))[pir - 1] = value
+        return (x, y)
+
+    def paintEvent(self, event):
+        if self._image.isNull():
+            return
+
+        painter = QPainter(self)
+        painter.drawImage(event.rect(), self._image, event.rect())
@@ -0,0 +1,48 @@
+from PySide6.QtCore import QTimer
+from PySide6.QtGui import QFont
+from PySide6.QtWidgets import QPlainTextEdit
+
+import time
+
+
+class LogView(QPlainTextEdit):
+    def __init__(self, sink, rate_hz=10, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Log")
+        self.setReadOnly(True)
+        self.setMaximumBlockCount(sink.lines.maxlen)
+        self.setFont(QFont("monospace"))
+        self.resize(720, 360)
+
+        self._sink = sink
+        self._sequence = 0
+        # Only polls the sink while it is shown, new lines are appended in
+        # one go per tick.
+        self._timer = QTimer(self)
+        self._timer.setInterval(int(1000 / rate_hz))
+        self._timer.timeout.connect(self.refresh)
+
+    def refresh(self):
+        self._sequence, lines = self._sink.since(self._sequence)
+        if not lines:
+            return
+
+        bar = self.verticalScrollBar()
+        following = bar.value() == bar.maximum()
+        self.appendPlainText(
+            "\n".join(
+                f"{time.strftime('%H:%M:%S', time.localtime(at))}  {line}"
+                for at, line in lines
+            )
+        )
+        if following:
+            bar.setValue(bar.maximum())
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self._timer.start()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self._timer.stop()